@@ -1,63 +1,204 @@
+import atexit
+import json
+import os
 import pickle
+import tempfile
+import threading
+
+LEGACY_CACHE_FILE = 'cache.pkl'
+SETTINGS_FILE = 'settings.json'
+SAVE_DELAY = 0.5  # seconds of quiet before pending changes are written
+APP_NAME = 'Work Order Manager'
+
+
+def get_user_cache_dir():
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser(os.path.join('~', 'AppData', 'Local'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache'))
+    path = os.path.join(base, APP_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_user_data_dir():
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser(os.path.join('~', 'AppData', 'Local'))
+    else:
+        base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser(os.path.join('~', '.local', 'share'))
+    path = os.path.join(base, APP_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_user_config_dir():
+    if os.name == 'nt':
+        base = os.environ.get('APPDATA') or os.path.expanduser(os.path.join('~', 'AppData', 'Roaming'))
+    else:
+        base = os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser(os.path.join('~', '.config'))
+    path = os.path.join(base, APP_NAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class SettingsStore:
+    """Settings loaded once and served from memory, written back atomically after a short debounce"""
+
+    def __init__(self, path=None, legacy_path=LEGACY_CACHE_FILE, delay=SAVE_DELAY):
+        self.path = path or os.path.join(get_user_config_dir(), SETTINGS_FILE)
+        self.legacy_path = legacy_path
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._timer = None
+        self._dirty = False
+        self._settings = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                settings = json.load(f)
+            if isinstance(settings, dict):
+                return settings
+        except (FileNotFoundError, ValueError):
+            pass
+
+        # First run with the new store: carry over the old cache.pkl from the working directory
+        settings = load_legacy_cache(self.legacy_path) or {}
+        if settings:
+            self._write(settings)
+        return settings
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._settings.get(key, default)
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._settings)
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def update(self, values):
+        with self._lock:
+            self._settings.update(values)
+            self._schedule()
+
+    def replace(self, values):
+        with self._lock:
+            self._settings = dict(values)
+            self._schedule()
+
+    def _schedule(self):
+        # Restart the timer on every change so a burst of changes costs a single write
+        self._dirty = True
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            self._write(self._settings)
+            self._dirty = False
+
+    def _write(self, settings):
+        directory = os.path.dirname(self.path) or '.'
+        fd, temp_path = tempfile.mkstemp(prefix='.settings-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(settings, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+def load_legacy_cache(path=LEGACY_CACHE_FILE):
+    try:
+        with open(path, 'rb') as f:
+            cache = pickle.load(f)
+        if isinstance(cache, dict):
+            return cache
+    except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+        pass
+    return None
 
-CACHE_FILE = 'cache.pkl'
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def get_settings():
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = SettingsStore()
+            atexit.register(_settings.flush)
+        return _settings
 
 
 def save_cache(cache):
-    with open(CACHE_FILE, 'wb') as f:
-        pickle.dump(cache, f)
+    get_settings().replace(cache)
 
 
 def load_cache(default=None):
-    try:
-        with open(CACHE_FILE, 'rb') as f:
-            cache = pickle.load(f)
-        if isinstance(cache, dict):
-            return cache
-    except (FileNotFoundError, pickle.UnpicklingError, EOFError):
-        pass
-    return default
+    cache = get_settings().as_dict()
+    return cache if cache else default
 
 
 def save_last_used_font_size(font_size):
-    cache = load_cache({})
-    cache['font_size'] = font_size
-    save_cache(cache)
+    get_settings().set('font_size', font_size)
 
 
 def load_last_used_font_size():
-    cache = load_cache({})
-    return str(int(cache.get('font_size', 14)))  # Convert the font size to a string
+    return str(int(get_settings().get('font_size', 14)))  # Convert the font size to a string
 
 
 def save_last_used_directory(directory):
-    cache = load_cache({})
-    cache['directory'] = directory
-    save_cache(cache)
+    get_settings().set('directory', directory)
 
 
 def load_last_used_directory():
-    cache = load_cache({})
-    return cache.get('directory')
+    return get_settings().get('directory')
 
 
 def save_last_used_export_directory(directory):
-    cache = load_cache({})
-    cache['export_directory'] = directory
-    save_cache(cache)
+    get_settings().set('export_directory', directory)
 
 
 def load_last_used_export_directory():
-    cache = load_cache({})
-    return cache.get('export_directory')
+    return get_settings().get('export_directory')
 
 
 def save_last_used_theme(theme):
-    cache = load_cache({})
-    cache['theme'] = theme
-    save_cache(cache)
+    get_settings().set('theme', theme)
 
 
 def load_last_used_theme():
-    cache = load_cache({})
-    return cache.get('theme')
+    return get_settings().get('theme')
+
+
+def save_last_used_table_view(view):
+    get_settings().set('table_view', view)
+
+
+def load_last_used_table_view():
+    return get_settings().get('table_view', 'listing')
+
+
+def save_last_used_memory_budget(megabytes):
+    get_settings().set('merge_memory_budget_mb', megabytes)
+
+
+def load_last_used_memory_budget():
+    return get_settings().get('merge_memory_budget_mb')
@@ -0,0 +1,108 @@
+"""
+One listing of the Work Folder tree shared by the FileArrangement stages.
+
+Every folder is read with a single os.scandir the first time a stage asks
+for it, and the stages record what they create, move and delete, so the
+next stage works from the same listing instead of walking the tree again.
+On network shares, where each listing and stat is a round trip, a whole
+pipeline run costs about one pass over the tree.
+
+Paths outside the folders listed so far are simply listed when they are
+first asked for, so one snapshot can serve the Work Folder and the Move
+Folder of a run. Changes made behind the snapshot's back (e.g. the user
+dropping photos into a folder between two jobs) are only seen after
+refresh(), which is why a snapshot lives for one run or one job.
+"""
+
+import os
+
+
+def _key(path):
+    return os.path.normpath(os.path.abspath(path))
+
+
+class DirectorySnapshot:
+    def __init__(self):
+        self._folders = {}  # folder path -> (set of subfolder names, set of file names)
+        self.scans = 0
+
+    def _listing(self, folder):
+        key = _key(folder)
+        listing = self._folders.get(key)
+        if listing is None:
+            dirs, files = set(), set()
+            try:
+                for entry in os.scandir(key):
+                    (dirs if entry.is_dir() else files).add(entry.name)
+            except FileNotFoundError:
+                pass
+            self.scans += 1
+            listing = self._folders[key] = (dirs, files)
+        return listing
+
+    def refresh(self, folder=None):
+        if folder is None:
+            self._folders.clear()
+            return
+        key = _key(folder)
+        for path in [path for path in self._folders if path == key or path.startswith(key + os.sep)]:
+            del self._folders[path]
+
+    def files(self, folder):
+        return sorted(self._listing(folder)[1])
+
+    def subfolders(self, folder):
+        return sorted(self._listing(folder)[0])
+
+    def names(self, folder):
+        dirs, files = self._listing(folder)
+        return dirs | files
+
+    def walk(self, top):
+        """Like os.walk(top), from the snapshot"""
+        top = _key(top)
+        dirs, files = self._listing(top)
+        dirs, files = sorted(dirs), sorted(files)
+        yield top, dirs, files
+        for name in dirs:
+            yield from self.walk(os.path.join(top, name))
+
+    def exists(self, path):
+        folder, name = os.path.split(_key(path))
+        return name in self.names(folder)
+
+    def is_dir(self, path):
+        folder, name = os.path.split(_key(path))
+        return name in self._listing(folder)[0]
+
+    def _parent_listing(self, path):
+        # Only folders that were already listed are updated, the others are listed when first needed
+        return self._folders.get(os.path.dirname(_key(path)))
+
+    def add_file(self, path):
+        listing = self._parent_listing(path)
+        if listing is not None:
+            listing[1].add(os.path.basename(_key(path)))
+
+    def remove_file(self, path):
+        listing = self._parent_listing(path)
+        if listing is not None:
+            listing[1].discard(os.path.basename(_key(path)))
+
+    def add_folder(self, path):
+        key = _key(path)
+        listing = self._parent_listing(key)
+        if listing is not None and os.path.basename(key) not in listing[0]:
+            listing[0].add(os.path.basename(key))
+            self._folders.setdefault(key, (set(), set()))  # Just created, so known to be empty
+
+    def remove_folder(self, path):
+        listing = self._parent_listing(path)
+        if listing is not None:
+            listing[0].discard(os.path.basename(_key(path)))
+        self.refresh(path)
+
+    def move(self, source, destination):
+        """Record a file moved or renamed from source to destination"""
+        self.remove_file(source)
+        self.add_file(destination)
@@ -1,77 +1,159 @@
+import contextlib
+import io
+import json
 import os
 import re
 import shutil
 import string
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from PIL import Image, ExifTags
-from pdf_compressor import compress
-from FileInfoFill import write_to_pdf, get_pdf_info
-from pypdf import PdfWriter, PdfReader
+# PIL and pypdf are imported inside the functions that use them, so the window opens without loading them
+from FileInfoFill import write_to_pdf, fill_template, get_pdf_info, find_work_order_number_fast
+
+import FileTransfer
+import Instrumentation
+from DirectorySnapshot import DirectorySnapshot
+import PdfCompression
+import PdfTextCache
+from WorkerPool import run_pool
 
 DEBUGGING = False
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+MIN_IMAGE_SIDE = 720  # Shorter side of a photo once it is converted to a PDF page
+MANIFEST_EXTENSION = ".manifest.json"  # Written next to <folder>_merged.pdf to skip unchanged folders
+IN_MEMORY_MERGE = True  # Render photos into memory buffers instead of *_converted.pdf files
+# Bytes of converted photos the merge may hold in memory; None merges each folder in a PdfWriter without a limit.
+# With a budget, photos over it are spilled to *_converted.pdf files and folders are streamed to disk page by page.
+MERGE_MEMORY_BUDGET = None
+# Byte-identical downloads are moved here by the rename instead of becoming "(1)" copies
+DUPLICATES_FOLDER = "Duplicates"
 
 
 def debug_print(*args, **kwargs):
+    # Kept for the old call sites; the messages also go into the trace when Instrumentation is tracing
     if DEBUGGING:
         print(*args, **kwargs)
+    Instrumentation.log(kwargs.get("sep", " ").join(str(arg) for arg in args))
+
+
+def report_progress(progress, done, total, item=None):
+    # progress is an optional callback(done, total, item) used by the GUI and batch runner
+    if progress:
+        progress(done, total, item)
+
+
+def journaled(journal, stage, action, paths):
+    # Stages take an optional RunJournal; without one the operation simply runs
+    return journal.operation(stage, action, paths) if journal else contextlib.nullcontext()
+
+
+def list_content_in_path(root_folder_path):
+    return [entry.name for entry in os.scandir(root_folder_path)]
 
 
 def display_content_in_path(root_folder_path):
-    content = [entry.name for entry in os.scandir(root_folder_path)]
-    content_str = "\n".join(content)
+    content_str = "\n".join(list_content_in_path(root_folder_path))
     debug_print("Content in root folder:\n", content_str)
     return content_str
 
 
-def get_subfolders(root_directory):
-    subfolders = [os.path.join(root_directory, folder) for folder in os.listdir(root_directory) if
-                  os.path.isdir(os.path.join(root_directory, folder)) and not any(
-                      char in string.ascii_letters for char in folder)]
+def get_subfolders(root_directory, snapshot=None):
+    snapshot = snapshot or DirectorySnapshot()
+    subfolders = [os.path.join(root_directory, folder) for folder in snapshot.subfolders(root_directory)
+                  if not any(char in string.ascii_letters for char in folder)]
     return subfolders
 
 
-def create_folders_and_move_files(root_folder_path):
-    for entry in os.scandir(root_folder_path):
-        file_path = entry.path
-        if entry.is_file() and file_path.endswith(".pdf"):
-            file_name = os.path.splitext(entry.name)[0]
-            folder_path = os.path.join(root_folder_path, file_name)
-            os.makedirs(folder_path, exist_ok=True)
-            shutil.move(file_path, os.path.join(folder_path, entry.name))
-
+@Instrumentation.traced("create-folders", is_stage=True)
+def create_folders_and_move_files(root_folder_path, progress=None, snapshot=None):
+    snapshot = snapshot or DirectorySnapshot()
+    filenames = [filename for filename in snapshot.files(root_folder_path) if filename.endswith(".pdf")]
+    for done, filename in enumerate(filenames, start=1):
+        folder_path = os.path.join(root_folder_path, os.path.splitext(filename)[0])
+        destination = os.path.join(folder_path, filename)
+        os.makedirs(folder_path, exist_ok=True)
+        snapshot.add_folder(folder_path)
+        with Instrumentation.span("move", file=filename):
+            shutil.move(os.path.join(root_folder_path, filename), destination)
+        snapshot.move(os.path.join(root_folder_path, filename), destination)
+        Instrumentation.count("files_processed")
+        report_progress(progress, done, len(filenames), filename)
+    return len(filenames)
+
+
+@Instrumentation.traced("fill-forms", is_stage=True)
+def fill_pdf_forms(root_directory, pdf_template, progress=None, workers=None, snapshot=None, journal=None):
+    snapshot = snapshot or DirectorySnapshot()
+    subfolders = get_subfolders(root_directory, snapshot)
+    if journal:
+        subfolders = [folder for folder in subfolders if not journal.is_done("fill-forms", os.path.basename(folder))]
+    if not subfolders:
+        return []
+    template_name = os.path.basename(pdf_template)
+
+    # Every worker process parses the template once and writes each filled copy straight into its order folder
+    results = []
+    arguments = [(folder_name, pdf_template, snapshot.exists(os.path.join(folder_name, template_name)))
+                 for folder_name in subfolders]
+    with run_pool(fill_pdf_form, arguments, workers) as completed:
+        for done, (args, result) in enumerate(completed, start=1):
+            results.append(result)
+            if not result["error"]:
+                snapshot.add_file(os.path.join(root_directory, result["order"], template_name))
+                if journal:
+                    journal.mark_done("fill-forms", result["order"])
+            report_progress(progress, done, len(arguments), result["order"])
+
+    failed = [result for result in results if result["error"]]
+    debug_print(f"Filled {len(results) - len(failed)} of {len(results)} work order forms.")
+    return results
+
+
+def fill_pdf_form(folder_name, pdf_template, template_exists=None):
+    order_num = os.path.basename(folder_name)
+    result = {"order": order_num, "error": None}
+    try:
+        with Instrumentation.span("fill", order=order_num):
+            fill_order_folder(folder_name, order_num, pdf_template, template_exists)
+        Instrumentation.count("files_processed")
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def fill_order_folder(folder_name, order_num, pdf_template, template_exists=None):
+    order_filename = os.path.join(folder_name, order_num + ".pdf")
+    template_filename = os.path.join(folder_name, os.path.basename(pdf_template))
+    [location, description] = get_pdf_info(order_filename)
+    if template_exists is None:
+        template_exists = os.path.exists(template_filename)
+    if template_exists:
+        # Keep whatever was already typed into an existing copy and only fill its empty fields
+        write_to_pdf(template_filename, order_num, location, description)
+    else:
+        fill_template(pdf_template, template_filename, order_num, location, description)
+    Instrumentation.count_file(template_filename, 'bytes_written')
 
-def copy_pdf_to_subfolders(root_directory, pdf_file):
-    subfolders = get_subfolders(root_directory)
-    for folder_name in subfolders:
-        destination = os.path.join(folder_name, pdf_file)
-        if not os.path.exists(destination):
-            shutil.copy2(pdf_file, destination)
-            debug_print(f"Copied {pdf_file} to {destination}")
-        else:
-            debug_print(f"{pdf_file} already exists in {destination}")
 
+def get_work_order_number(filename):
+    return PdfTextCache.cached_field(filename, 'work_order_number', lambda: parse_work_order_number(filename))
 
-def fill_pdf_forms(root_directory, pdf_template):
-    subfolders = get_subfolders(root_directory)
-    for folder_name in subfolders:
-        order_num = os.path.basename(folder_name)
-        order_filename = os.path.join(folder_name, order_num + ".pdf")
-        template_filename = os.path.join(folder_name, pdf_template)
-        [location, description] = get_pdf_info(order_filename)
-        write_to_pdf(template_filename, order_num, location, description)
 
+def parse_work_order_number(filename):
+    work_order_number = find_work_order_number_fast(filename)
+    if work_order_number:
+        return work_order_number
 
-def get_work_order_number(pdf):
-    for page in pdf.pages:
-        content = page.extract_text()
+    # Fall back to full text extraction of every page when the content stream gave nothing
+    for content in PdfTextCache.iter_page_texts(filename):
         match = re.search(r'Work Order #\s*(\d+)', content)
         if match:
             return match.group(1)
     return None
 
 
-def get_new_filename(directory, work_order_number, renamed_numbers):
-    existing_files = set(os.listdir(directory))
+def resolve_new_filename(existing_files, work_order_number, renamed_numbers):
     base_filename = f"{work_order_number}.pdf"
     i = 1
     while base_filename in existing_files or base_filename in renamed_numbers:
@@ -80,170 +162,659 @@ def get_new_filename(directory, work_order_number, renamed_numbers):
     return base_filename
 
 
-def rename_pdf_files(directory):
+def read_work_order_number(filepath):
+    try:
+        with Instrumentation.span("parse", file=os.path.basename(filepath)):
+            work_order_number = get_work_order_number(filepath)
+        Instrumentation.count("files_processed")
+        return work_order_number, None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+@Instrumentation.traced("plan-renames", is_stage=True)
+def plan_renames(directory, workers=None, progress=None, snapshot=None):
+    # A single listing of the folder serves both the candidates and the collision check
+    snapshot = snapshot or DirectorySnapshot()
+    existing_files = snapshot.names(directory)
+    filenames = sorted(filename for filename in existing_files
+                       if filename.endswith('.pdf') and not filename[:5].isdigit())
+    if not filenames:
+        return []
+
+    numbers = {}
+    with run_pool(read_work_order_number, [(os.path.join(directory, filename),) for filename in filenames],
+                  workers) as completed:
+        for done, ((filepath,), result) in enumerate(completed, start=1):
+            numbers[os.path.basename(filepath)] = result
+            report_progress(progress, done, len(filenames), os.path.basename(filepath))
+
+    plan = []
     renamed_numbers = set()
-
-    for filename in os.listdir(directory):
-        if filename.endswith('.pdf') and not filename[:5].isdigit():
-            filepath = os.path.join(directory, filename)
-            with open(filepath, 'rb') as file:
-                pdf = PdfReader(file)
-                work_order_number = get_work_order_number(pdf)
-                pdf.stream.close()
-                if work_order_number:
-                    new_filename = get_new_filename(directory, work_order_number, renamed_numbers)
-                    renamed_numbers.add(new_filename)
-                    new_filepath = os.path.join(directory, new_filename)
-                    os.rename(filepath, new_filepath)
-                    debug_print(f"Renamed {filename} to {new_filename}")
-
-
-def create_job_images_folders(root_folder_path):
-    for root, dirs, files in os.walk(root_folder_path):
-        if root == root_folder_path:
-            continue  # Skip the root directory
-
+    for filename in filenames:
+        work_order_number, error = numbers[filename]
+        plan.append({"file": filename, "work_order_number": work_order_number, "new_name": None, "error": error,
+                     "duplicate_of": None, "conflicts": []})
+    find_duplicate_orders(directory, plan, snapshot)
+    for entry in plan:
+        if entry["work_order_number"] and not entry["duplicate_of"]:
+            entry["new_name"] = resolve_new_filename(existing_files, entry["work_order_number"], renamed_numbers)
+            renamed_numbers.add(entry["new_name"])
+    return plan
+
+
+def numbered_copies(directory, work_order_number, snapshot):
+    """Files already named after work_order_number, in the folder itself or in the order's folder"""
+    pattern = re.compile(rf'{re.escape(work_order_number)}(?: \(\d+\))?\.pdf')
+    paths = [os.path.join(directory, name) for name in sorted(snapshot.files(directory)) if pattern.fullmatch(name)]
+    order_file = os.path.join(directory, work_order_number, f"{work_order_number}.pdf")
+    if snapshot.is_dir(os.path.dirname(order_file)) and snapshot.exists(order_file):
+        paths.append(order_file)
+    return paths
+
+
+def group_identical_files(paths):
+    """Group paths by content: sizes first, and a streamed hash only for files whose size is shared"""
+    by_size = {}
+    for path in paths:
+        by_size.setdefault(os.path.getsize(path), []).append(path)
+    groups = []
+    for same_size in by_size.values():
+        if len(same_size) == 1:
+            groups.append(same_size)
+            continue
+        by_hash = {}
+        for path in same_size:
+            with Instrumentation.span("hash", file=os.path.basename(path)):
+                by_hash.setdefault(PdfTextCache.hash_file(path), []).append(path)
+            Instrumentation.count_file(path)
+        groups.extend(by_hash.values())
+    return groups
+
+
+def find_duplicate_orders(directory, plan, snapshot):
+    # Files already named after a number come first, so a new download is the one marked as the duplicate
+    entries = {}
+    for entry in plan:
+        if entry["work_order_number"]:
+            entries.setdefault(entry["work_order_number"], []).append(entry)
+    for work_order_number, same_number in entries.items():
+        existing = numbered_copies(directory, work_order_number, snapshot)
+        if not existing and len(same_number) == 1:
+            continue
+        by_path = {os.path.join(directory, entry["file"]): entry for entry in same_number}
+        groups = group_identical_files(existing + list(by_path))
+        for group in groups:
+            for path in group[1:]:
+                if path in by_path:
+                    by_path[path]["duplicate_of"] = os.path.relpath(group[0], directory)
+        if len(groups) > 1:
+            # Same number but different content: still renamed to "(1)", but flagged for a look
+            kept = [os.path.relpath(group[0], directory) for group in groups]
+            for path, entry in by_path.items():
+                if not entry["duplicate_of"]:
+                    entry["conflicts"] = [name for name in kept if name != entry["file"]]
+
+
+@Instrumentation.traced("rename", is_stage=True)
+def apply_rename_plan(directory, plan, progress=None, snapshot=None):
+    # The plan may be older than this run's snapshot (e.g. after a preview), so the folder is listed afresh
+    snapshot = snapshot or DirectorySnapshot()
+    snapshot.refresh(directory)
+    renamed = 0
+    for done, entry in enumerate(plan, start=1):
+        if entry.get("duplicate_of"):
+            quarantine_duplicate(directory, entry["file"], snapshot)
+            debug_print(f"Moved {entry['file']} to {DUPLICATES_FOLDER}, same content as {entry['duplicate_of']}")
+        elif entry["new_name"]:
+            new_filepath = os.path.join(directory, entry["new_name"])
+            if snapshot.exists(new_filepath):
+                # Something took the name after the plan was made, fall back to the next free one
+                entry["new_name"] = resolve_new_filename(snapshot.names(directory), entry["work_order_number"], set())
+                new_filepath = os.path.join(directory, entry["new_name"])
+            with Instrumentation.span("move", file=entry["file"], to=entry["new_name"]):
+                os.rename(os.path.join(directory, entry["file"]), new_filepath)
+            snapshot.move(os.path.join(directory, entry["file"]), new_filepath)
+            renamed += 1
+            debug_print(f"Renamed {entry['file']} to {entry['new_name']}")
+        report_progress(progress, done, len(plan), entry["file"])
+    return renamed
+
+
+def describe_rename(entry):
+    if entry.get("duplicate_of"):
+        return f"{DUPLICATES_FOLDER} (same as {entry['duplicate_of']})"
+    return entry["new_name"] or entry["error"] or "No work order # found"
+
+
+def quarantine_duplicate(directory, filename, snapshot):
+    duplicates_folder = os.path.join(directory, DUPLICATES_FOLDER)
+    if not snapshot.is_dir(duplicates_folder):
+        os.makedirs(duplicates_folder, exist_ok=True)
+        snapshot.add_folder(duplicates_folder)
+    destination = os.path.join(duplicates_folder, filename)
+    if snapshot.exists(destination):
+        stem, extension = os.path.splitext(filename)
+        i = 1
+        while snapshot.exists(destination):
+            destination = os.path.join(duplicates_folder, f"{stem} ({i}){extension}")
+            i += 1
+    with Instrumentation.span("move", file=filename, to=DUPLICATES_FOLDER):
+        os.rename(os.path.join(directory, filename), destination)
+    snapshot.move(os.path.join(directory, filename), destination)
+
+
+def rename_pdf_files(directory, progress=None, workers=None, snapshot=None):
+    snapshot = snapshot or DirectorySnapshot()
+    plan = plan_renames(directory, workers, progress, snapshot)
+    return apply_rename_plan(directory, plan, progress, snapshot)
+
+
+@Instrumentation.traced("backup-images", is_stage=True)
+def create_job_images_folders(root_folder_path, progress=None, mode=None, snapshot=None):
+    # Backups are reflinks or hardlinks where the filesystem allows it, so they cost next to no I/O or space
+    mode = mode or FileTransfer.detect_backup_mode(root_folder_path)
+    snapshot = snapshot or DirectorySnapshot()
+    modes_used = {}
+    # Backups left by a run that stopped before the restore are put back first, so they aren't backed up themselves
+    for folder_name in job_images_parents(root_folder_path, snapshot):
+        restore_job_images(folder_name, snapshot)
+    duplicates_folder = os.path.join(os.path.abspath(root_folder_path), DUPLICATES_FOLDER)
+    folders = [folder for folder in list(snapshot.walk(root_folder_path))[1:]  # Skip the root directory
+               if folder[0] != duplicates_folder and not folder[0].startswith(duplicates_folder + os.sep)]
+    for done, (root, dirs, files) in enumerate(folders, start=1):
         job_images_folder = os.path.join(root, "Job Images")
 
-        if not os.path.exists(job_images_folder):
-            os.makedirs(job_images_folder)
+        if "Job Images" not in dirs:
+            os.makedirs(job_images_folder, exist_ok=True)
+            snapshot.add_folder(job_images_folder)
             debug_print(f"Created '{job_images_folder}' folder.")
 
         for file in files:
             if any(file.lower().endswith(image_ext) for image_ext in [".jpg", ".jpeg", ".png", ".gif"]):
                 source_path = os.path.join(root, file)
                 destination_path = os.path.join(job_images_folder, file)
-                shutil.copy2(source_path, destination_path)
-                debug_print(f"Copied file '{file}' to '{job_images_folder}'.")
-
-
-def move_files_and_delete_folder(root_folder_path):
-    for folder_name, subfolders, filenames in os.walk(root_folder_path):
-        if "Job Images" in subfolders:
-            job_images_folder = os.path.join(folder_name, "Job Images")
-            for file in os.listdir(job_images_folder):
-                source = os.path.join(job_images_folder, file)
-                destination = os.path.join(folder_name, file)
-                shutil.move(source, destination)
-            os.rmdir(job_images_folder)
-
-
-def merge_pdfs_and_images(directory):
-    for folder_name in os.listdir(directory):
-        folder_path = os.path.join(directory, folder_name)
-        if os.path.isdir(folder_path):
-            pdf_files = collect_pdf_files(folder_path)
-            image_files = collect_image_files(folder_path, pdf_files)
-            merge_pdf_and_images(image_files, folder_path)
-    debug_print("PDF and image merging completed.")
-
-
-def collect_pdf_files(folder_path):
+                with Instrumentation.span("backup", file=file, mode=mode):
+                    used = FileTransfer.backup_file(source_path, destination_path, mode)
+                snapshot.add_file(destination_path)
+                modes_used[used] = modes_used.get(used, 0) + 1
+                if used not in ("reflink", "hardlink"):
+                    Instrumentation.count_file(destination_path, 'bytes_written')
+                debug_print(f"Backed up file '{file}' to '{job_images_folder}' ({used}).")
+        report_progress(progress, done, len(folders), os.path.basename(root))
+    return {"mode": mode, "files": sum(modes_used.values()), "modes": modes_used}
+
+
+@Instrumentation.traced("restore-images", is_stage=True)
+def move_files_and_delete_folder(root_folder_path, progress=None, snapshot=None):
+    snapshot = snapshot or DirectorySnapshot()
+    folders = job_images_parents(root_folder_path, snapshot)
+    for done, folder_name in enumerate(folders, start=1):
+        restore_job_images(folder_name, snapshot)
+        report_progress(progress, done, len(folders), os.path.basename(folder_name))
+
+
+def job_images_parents(root_folder_path, snapshot):
+    return [folder_name for folder_name, subfolders, filenames in snapshot.walk(root_folder_path)
+            if "Job Images" in subfolders and os.path.basename(folder_name) != "Job Images"]
+
+
+def restore_job_images(folder_name, snapshot):
+    job_images_folder = os.path.join(folder_name, "Job Images")
+    if snapshot.is_dir(os.path.join(job_images_folder, "Job Images")):
+        # Nested by an older backup of a folder whose restore never ran, unwound from the inside out
+        restore_job_images(job_images_folder, snapshot)
+    for file in snapshot.files(job_images_folder):
+        source = os.path.join(job_images_folder, file)
+        destination = os.path.join(folder_name, file)
+        if snapshot.exists(destination) and os.path.samefile(source, destination):
+            # A hardlinked backup of a photo the merge kept: both names are the same file, drop the backup
+            os.remove(source)
+            snapshot.remove_file(source)
+            continue
+        shutil.move(source, destination)
+        snapshot.move(source, destination)
+    os.rmdir(job_images_folder)
+    snapshot.remove_folder(job_images_folder)
+
+
+@Instrumentation.traced("merge", is_stage=True)
+def merge_pdfs_and_images(directory, progress=None, workers=None, in_memory=IN_MEMORY_MERGE, force=False,
+                          snapshot=None, journal=None, memory_budget=MERGE_MEMORY_BUDGET):
+    snapshot = snapshot or DirectorySnapshot()
+    # Pages converted by a run that stopped before merging them; their photos are converted again
+    delete_converted_pdfs(directory, snapshot)
+    folders = {}
+    skipped = 0
+    for name in snapshot.subfolders(directory):
+        folder_path = os.path.join(directory, name)
+        if name == DUPLICATES_FOLDER:
+            continue
+        pdf_files = collect_pdf_files(folder_path, snapshot)
+        image_files = collect_image_files(folder_path, pdf_files, snapshot)
+        if not force and merge_is_up_to_date(folder_path, image_files, snapshot):
+            skipped += 1
+            debug_print(f"Skipped {name}, inputs unchanged since the last merge")
+            continue
+        if journal and journal.is_done("merge", name) and not merge_has_new_inputs(folder_path, image_files):
+            skipped += 1  # Merged before an interrupted run stopped, its photos may already be gone
+            continue
+        folders[folder_path] = image_files
+
+    images = [(folder_path, file) for folder_path, image_files in folders.items()
+              for file in image_files if not file.endswith(".pdf")]
+    total = len(images) + len(folders)
+    done = 0
+    timings = []
+    peak_rss = {}
+    held = {}  # folder path -> bytes of its converted photos held in memory
+
+    def merge_folder(folder_path, conversions):
+        nonlocal done
+        with Instrumentation.PeakRss() as sampler:
+            merge_pdf_and_images(folders[folder_path], folder_path, conversions, snapshot=snapshot, journal=journal,
+                                 memory_budget=memory_budget)
+        held.pop(folder_path, None)
+        if sampler.peak is not None:
+            peak_rss[os.path.basename(folder_path)] = round(sampler.peak / 2 ** 20, 1)
+        if journal:
+            journal.mark_done("merge", os.path.basename(folder_path))
+        done += 1
+        report_progress(progress, done, total, os.path.basename(folder_path))
+        for conversion in conversions.values():
+            conversion.pop("pdf_bytes", None)  # Free the page as soon as its folder is written
+            timings.append(conversion)
+
+    pending = {folder_path: 0 for folder_path in folders}
+    for folder_path, file in images:
+        pending[folder_path] += 1
+    for folder_path in [folder_path for folder_path, count in pending.items() if count == 0]:
+        merge_folder(folder_path, {})
+
+    # Photos of every folder share one process pool, and a folder is merged as soon as its last photo is converted
+    if images:
+        conversions = {folder_path: {} for folder_path in folders}
+        folder_of = {file: folder_path for folder_path, file in images}
+        with run_pool(convert_image_timed, [(file, in_memory) for folder_path, file in images], workers) as completed:
+            for args, conversion in completed:
+                folder_path = folder_of[conversion["file"]]
+                if memory_budget is not None and conversion["pdf_bytes"] is not None:
+                    if sum(held.values()) + len(conversion["pdf_bytes"]) > memory_budget:
+                        spill_conversion(conversion, snapshot)
+                    else:
+                        held[folder_path] = held.get(folder_path, 0) + len(conversion["pdf_bytes"])
+                conversions[folder_path][conversion["file"]] = conversion
+                done += 1
+                report_progress(progress, done, total, os.path.basename(conversion["file"]))
+                pending[folder_path] -= 1
+                if pending[folder_path] == 0:
+                    merge_folder(folder_path, conversions.pop(folder_path))
+
+    worker_seconds = sum(timing['seconds'] for timing in timings)
+    debug_print(f"PDF and image merging completed: {len(folders)} folders merged, {skipped} unchanged, "
+                f"{len(timings)} images converted in {worker_seconds:.2f}s of worker time.")
+    return {"folders": len(folders) + skipped, "merged": len(folders), "skipped": skipped, "images": timings,
+            "memory_budget": memory_budget, "peak_rss_mb": peak_rss}
+
+
+def spill_conversion(conversion, snapshot):
+    # Over the memory budget: the page waits for the rest of its folder on disk instead
+    pdf_path = os.path.splitext(conversion["file"])[0] + "_converted.pdf"
+    with open(pdf_path, "wb") as f:
+        f.write(conversion["pdf_bytes"])
+    Instrumentation.count("bytes_written", len(conversion["pdf_bytes"]))
+    conversion["pdf_path"] = pdf_path
+    conversion["pdf_bytes"] = None
+    snapshot.add_file(pdf_path)
+
+
+def collect_pdf_files(folder_path, snapshot=None):
+    snapshot = snapshot or DirectorySnapshot()
     pdf_files = []
-    for file_name in os.listdir(folder_path):
-        if file_name.endswith(".pdf"):
+    for file_name in snapshot.files(folder_path):
+        if file_name.endswith(".pdf") and not file_name.endswith(("_merged.pdf", "_converted.pdf")):
             pdf_files.append(os.path.join(folder_path, file_name))
     return pdf_files
 
 
-def collect_image_files(folder_path, pdf_files):
+def collect_image_files(folder_path, pdf_files, snapshot=None):
+    snapshot = snapshot or DirectorySnapshot()
     image_files = []
 
     # Add all PDF files to the image_files list
     image_files.extend(pdf_files)
 
     # Collect all image files in the folder
-    for filename in os.listdir(folder_path):
-        if filename.endswith((".jpg", ".jpeg", ".png")):
+    for filename in snapshot.files(folder_path):
+        if filename.endswith(IMAGE_EXTENSIONS):
             image_files.append(os.path.join(folder_path, filename))
 
     return image_files
 
 
-def merge_pdf_and_images(image_files, folder_path):
-    output_filename = f"{os.path.basename(os.path.normpath(folder_path))}_merged.pdf"
-    output_file = os.path.join(folder_path, output_filename)
+def merged_output_path(folder_path):
+    return os.path.join(folder_path, f"{os.path.basename(os.path.normpath(folder_path))}_merged.pdf")
+
 
-    merger = PdfWriter()
+def merge_manifest_path(folder_path):
+    return os.path.splitext(merged_output_path(folder_path))[0] + MANIFEST_EXTENSION
 
+
+def describe_file(file_path, with_hash=True):
+    stat = os.stat(file_path)
+    description = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        description["sha1"] = PdfTextCache.hash_file(file_path)
+    return description
+
+
+def write_merge_manifest(folder_path, input_files):
+    # Hashes are taken before the photos are deleted, and the output is recorded so a replaced merge gets rebuilt
+    manifest = {
+        "inputs": {os.path.basename(file): describe_file(file) for file in input_files},
+        "output": describe_file(merged_output_path(folder_path), with_hash=False),
+    }
+    with open(merge_manifest_path(folder_path), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def merge_is_up_to_date(folder_path, input_files, snapshot=None):
+    output_file = merged_output_path(folder_path)
+    if snapshot is not None and not snapshot.exists(merge_manifest_path(folder_path)):
+        return False  # Never merged, no need to try opening the manifest
+    try:
+        with open(merge_manifest_path(folder_path), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if describe_file(output_file, with_hash=False) != manifest["output"]:
+            return False
+    except (OSError, ValueError, KeyError):
+        return False
+
+    recorded = manifest.get("inputs", {})
+    if set(recorded) != {os.path.basename(file) for file in input_files}:
+        return False
+    return not any(input_changed(file, recorded[os.path.basename(file)]) for file in input_files)
+
+
+def merge_has_new_inputs(folder_path, input_files):
+    """Whether inputs were added or changed since the last merge; gone ones, like merged photos, don't count"""
+    try:
+        with open(merge_manifest_path(folder_path), "r", encoding="utf-8") as f:
+            recorded = json.load(f)["inputs"]
+    except (OSError, ValueError, KeyError):
+        return True
+    return any(os.path.basename(file) not in recorded or input_changed(file, recorded[os.path.basename(file)])
+               for file in input_files)
+
+
+def input_changed(file, expected):
+    current = describe_file(file, with_hash=False)
+    if current["size"] != expected["size"]:
+        return True
+    # Only hash when the size matches but the timestamp moved, e.g. after a copy that didn't keep it
+    return current["mtime_ns"] != expected["mtime_ns"] and PdfTextCache.hash_file(file) != expected["sha1"]
+
+
+def merge_pdf_and_images(image_files, folder_path, conversions=None, in_memory=IN_MEMORY_MERGE, snapshot=None,
+                         journal=None, memory_budget=None):
+    with Instrumentation.span("merge-folder", folder=os.path.basename(folder_path)):
+        write_merged_folder(image_files, folder_path, conversions, in_memory, snapshot, journal, memory_budget)
+    Instrumentation.count("files_processed")
+
+
+def write_merged_folder(image_files, folder_path, conversions=None, in_memory=IN_MEMORY_MERGE, snapshot=None,
+                        journal=None, memory_budget=None):
+    snapshot = snapshot or DirectorySnapshot()
+    output_file = merged_output_path(folder_path)
+
+    # With a memory budget every page goes to disk as it's appended, instead of the whole folder at write()
+    if memory_budget is not None:
+        from StreamingMerge import StreamingMerge
+
+        with StreamingMerge(output_file) as merger:
+            merged_files, converted_images = append_folder_pages(merger, image_files, conversions, in_memory, True)
+    else:
+        from pypdf import PdfWriter
+
+        merger = PdfWriter()
+        merged_files, converted_images = append_folder_pages(merger, image_files, conversions, in_memory, False)
+        merger.write(output_file)
+        merger.close()
+    Instrumentation.count_file(output_file, 'bytes_written')
+    # A photo that failed to convert stays out of the manifest, so the folder is retried on the next run
+    write_merge_manifest(folder_path, merged_files)
+    snapshot.add_file(output_file)
+    snapshot.add_file(merge_manifest_path(folder_path))
+
+    sources = [conversion["file"] for conversion in converted_images]
+    sources += [conversion["pdf_path"] for conversion in converted_images if conversion["pdf_path"]]
+    with journaled(journal, "merge", "delete", sources):
+        for source in sources:
+            os.remove(source)
+            snapshot.remove_file(source)
+
+
+def append_folder_pages(merger, image_files, conversions, in_memory, streaming):
+    converted_images = []
+    merged_files = []
     for file in image_files:
         if file.endswith(".pdf"):
             merger.append(file)
+            Instrumentation.count_file(file)
+            merged_files.append(file)
         else:
-            converted_pdf_path = convert_image_to_pdf(file)
-            merger.append(converted_pdf_path)
-            os.remove(file)
-
-    merger.write(output_file)
-    merger.close()
-
-
-def convert_image_to_pdf(image_file):
-    # Open the image
-    image = Image.open(image_file)
-
-    # Rotate the image based on EXIF data
-    orientation = next((k for k, v in ExifTags.TAGS.items() if v == 'Orientation'), None)
-    if orientation:
-        exif = image.getexif()
-        if exif and orientation in exif:
-            exif_orientation = exif[orientation]
-            if exif_orientation == 3:
-                image = image.rotate(180, expand=True)
-            elif exif_orientation == 6:
-                image = image.rotate(270, expand=True)
-            elif exif_orientation == 8:
-                image = image.rotate(90, expand=True)
+            conversion = conversions[file] if conversions else convert_image_timed(file, in_memory)
+            if conversion["error"]:
+                debug_print(f"Skipped {file}: {conversion['error']}")
+                continue
+            if conversion["pdf_bytes"] is not None:
+                merger.append(io.BytesIO(conversion["pdf_bytes"]))
+                if streaming:
+                    conversion["pdf_bytes"] = None  # Its page is on disk already
+            else:
+                merger.append(conversion["pdf_path"])
+            converted_images.append(conversion)
+            merged_files.append(file)
+    return merged_files, converted_images
+
+
+def convert_image_timed(image_file, in_memory=IN_MEMORY_MERGE):
+    start = time.perf_counter()
+    conversion = {"file": image_file, "pdf_path": None, "pdf_bytes": None, "seconds": None, "source_size": None,
+                  "decoded_size": None, "error": None}
+    try:
+        with Instrumentation.span("convert", file=os.path.basename(image_file)):
+            if in_memory:
+                buffer = io.BytesIO()
+                convert_image_to_pdf(image_file, conversion, buffer)
+                conversion["pdf_bytes"] = buffer.getvalue()
+                Instrumentation.count("bytes_written", len(conversion["pdf_bytes"]))
+            else:
+                conversion["pdf_path"] = convert_image_to_pdf(image_file, conversion)
+                Instrumentation.count_file(conversion["pdf_path"], 'bytes_written')
+        Instrumentation.count_file(image_file)
+        Instrumentation.count("files_processed")
+    except Exception as e:
+        conversion["error"] = f"{type(e).__name__}: {e}"
+    conversion["seconds"] = round(time.perf_counter() - start, 4)
+    return conversion
+
+
+def convert_image_to_pdf(image_file, stats=None, output=None):
+    from PIL import Image, ImageOps
+
+    with Image.open(image_file) as image:
+        source_size = image.size
+
+        # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding when the photo is much larger than needed.
+        # draft() never goes below the requested size, so the final resize still sees enough pixels.
+        scale_factor = max(MIN_IMAGE_SIDE / image.width, MIN_IMAGE_SIDE / image.height)
+        if image.format == "JPEG" and scale_factor < 0.5:
+            image.draft("RGB", (int(image.width * scale_factor) + 1, int(image.height * scale_factor) + 1))
+
+        # Rotate the image based on EXIF data, in a single transpose
+        image = ImageOps.exif_transpose(image)
+
+    if stats is not None:
+        stats["source_size"] = source_size
+        stats["decoded_size"] = image.size
 
     # Calculate the scale factor while maintaining a minimum resolution of 720p
-    scale_factor = max(720 / image.width, 720 / image.height)
+    scale_factor = max(MIN_IMAGE_SIDE / image.width, MIN_IMAGE_SIDE / image.height)
     new_width, new_height = int(image.width * scale_factor), int(image.height * scale_factor)
 
     # Resize the image and convert it to RGB
-    rgb_image = image.resize((new_width, new_height), Image.ANTIALIAS).convert('RGB')
+    rgb_image = image.resize((new_width, new_height), Image.LANCZOS).convert('RGB')
 
-    # Save the resized and rotated image as a PDF
+    # Render the page straight into the given buffer, or save the resized and rotated image as a PDF next to it
+    if output is not None:
+        rgb_image.save(output, format="PDF")
+        return None
     pdf_path = os.path.splitext(image_file)[0] + "_converted.pdf"
     rgb_image.save(pdf_path)
 
     return pdf_path
 
 
-def delete_converted_pdfs(root_directory):
-    for root, dirs, files in os.walk(root_directory):
+def delete_converted_pdfs(root_directory, snapshot=None):
+    snapshot = snapshot or DirectorySnapshot()
+    deleted_count = 0
+    for root, dirs, files in snapshot.walk(root_directory):
         for file in files:
             if file.endswith("_converted.pdf"):
                 file_path = os.path.join(root, file)
                 os.remove(file_path)
+                snapshot.remove_file(file_path)
+                deleted_count += 1
                 debug_print(f"Deleted file: {file_path}")
 
     debug_print("Deletion of converted PDF files completed.")
-
-
-def move_merged_pdfs(root_directory, destination_directory):
-    for folder_name, subfolders, filenames in os.walk(root_directory):
-        for filename in filenames:
-            if filename.endswith("_merged.pdf"):
-                source_path = os.path.join(folder_name, filename)
-                destination_path = os.path.join(destination_directory, filename)
-                shutil.move(source_path, destination_path)
-                debug_print(f"Moved file: {filename}")
-
-
-def compress_pdf_files(directory, power=0):
-    for filename in os.listdir(directory):
-        if filename.endswith('.pdf'):
-            input_file = os.path.join(directory, filename)
-            output_file = os.path.join(directory, 'compressed_' + filename)
-            compress(input_file, output_file, power)
-            os.remove(input_file)
-
-
-def remove_pre_and_suf(directory):
-    for filename in os.listdir(directory):
+    return deleted_count
+
+
+@Instrumentation.traced("move-merged", is_stage=True)
+def move_merged_pdfs(root_directory, destination_directory, progress=None, snapshot=None, journal=None,
+                     workers=FileTransfer.TRANSFER_WORKERS, buffer_size=FileTransfer.TRANSFER_BUFFER_SIZE,
+                     opener=open):
+    # The Move Folder is often a network share, so several files are copied at once with large buffers
+    snapshot = snapshot or DirectorySnapshot()
+    moves = [(os.path.join(folder_name, filename), os.path.join(destination_directory, filename))
+             for folder_name, subfolders, filenames in snapshot.walk(root_directory)
+             for filename in filenames if filename.endswith("_merged.pdf")]
+
+    def moved(source_path, destination_path, result):
+        snapshot.move(source_path, destination_path)
+        if result["method"] == "copy":
+            Instrumentation.count("bytes_written", result["bytes"])
+        debug_print(f"Moved file: {result['file']} ({result['method']}, {result['seconds']}s)")
+
+    @contextlib.contextmanager
+    def wrap(source_path, destination_path):
+        with Instrumentation.span("move", file=os.path.basename(source_path)), \
+                journaled(journal, "move-merged", "move", [source_path, destination_path]):
+            yield
+
+    with Instrumentation.span("transfer", files=len(moves), workers=workers) as transfer:
+        report = FileTransfer.transfer_files(moves, workers, buffer_size, opener, progress, wrap=wrap, on_moved=moved)
+        transfer.set(bytes=report["bytes"], mb_per_second=report["mb_per_second"])
+    return report
+
+
+@Instrumentation.traced("compress", is_stage=True)
+def compress_pdf_files(directory, power=0, workers=None, progress=None, engine=PdfCompression.DEFAULT_ENGINE,
+                       min_size=PdfCompression.MIN_SIZE, target_size=None, snapshot=None, journal=None):
+    snapshot = snapshot or DirectorySnapshot()
+    filenames = [filename for filename in snapshot.files(directory) if filename.endswith('.pdf')
+                 and not (journal and journal.is_done("compress", compress_item(directory, filename)))]
+    if not filenames:
+        return []
+    engine = PdfCompression.get_engine(engine)
+
+    # A gs worker thread only waits on its own gs process, while the pypdf engine needs processes of its own
+    executor_class = ProcessPoolExecutor if engine.in_process else ThreadPoolExecutor
+    results = []
+    arguments = [(directory, filename, power, engine, min_size, target_size) for filename in filenames]
+    # Files that finish after a cancel still have their original, so their copy would clash with it in
+    # remove-pre-and-suf; they are compressed again on the next run
+    with run_pool(compress_pdf_file, arguments, workers, executor_class,
+                  discard=lambda args, result: discard_compressed_copy(directory, result)) as completed:
+        for done, (args, result) in enumerate(completed, start=1):
+            results.append(result)
+            if not (result["error"] or result["skipped"] or result["kept_original"]):
+                # The original goes only once its compressed copy is in place
+                input_file = os.path.join(directory, result["file"])
+                with journaled(journal, "compress", "delete", [input_file]):
+                    os.remove(input_file)
+                snapshot.move(input_file, os.path.join(directory, 'compressed_' + result["file"]))
+                if journal:
+                    journal.mark_done("compress", compress_item(directory, 'compressed_' + result["file"]))
+            if journal and not result["error"]:
+                journal.mark_done("compress", compress_item(directory, result["file"]))
+            report_progress(progress, done, len(arguments), result["file"])
+
+    summary = summarize_compression(results)
+    debug_print(f"Compressed {summary['compressed']} of {summary['files']} files with {engine.name} "
+                f"({summary['initial_size'] / 1000000:.2f}MB -> {summary['final_size'] / 1000000:.2f}MB), "
+                f"{summary['skipped']} skipped, {summary['kept_original']} kept, {summary['failed']} failed.")
+    return results
+
+
+def compress_item(directory, filename):
+    # The journal belongs to the Work Folder, so files of the Move Folder are recorded by full path
+    return os.path.normcase(os.path.abspath(os.path.join(directory, filename)))
+
+
+def compress_pdf_file(directory, filename, power=0, engine=None, min_size=PdfCompression.MIN_SIZE,
+                      target_size=None):
+    input_file = os.path.join(directory, filename)
+    output_file = os.path.join(directory, 'compressed_' + filename)
+    result = {"file": filename, "engine": None, "level": None, "initial_size": None, "final_size": None,
+              "saved": None, "ratio": None, "kept_original": False, "skipped": None, "error": None}
+    try:
+        engine = engine or PdfCompression.get_engine()
+        with Instrumentation.span("compress-file", file=filename, power=power):
+            result.update(PdfCompression.compress_file(input_file, output_file, engine, power, min_size,
+                                                       target_size))
+        Instrumentation.count("files_processed")
+    except Exception as e:
+        # Leave the original in place so a failed file can be retried on the next run
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        result["error"] = str(e)
+        debug_print(f"Compression failed for {filename}: {e}")
+    return result
+
+
+def discard_compressed_copy(directory, result):
+    output_file = os.path.join(directory, 'compressed_' + result["file"])
+    if not (result["error"] or result["skipped"] or result["kept_original"]) and os.path.exists(output_file):
+        os.remove(output_file)
+
+
+def summarize_compression(results):
+    succeeded = [result for result in results if not result["error"]]
+    return {
+        "files": len(results),
+        "compressed": sum(1 for result in succeeded if not (result["skipped"] or result["kept_original"])),
+        "skipped": sum(1 for result in succeeded if result["skipped"]),
+        "kept_original": sum(1 for result in succeeded if result["kept_original"]),
+        "failed": len(results) - len(succeeded),
+        "initial_size": sum(result["initial_size"] for result in succeeded),
+        "final_size": sum(result["final_size"] for result in succeeded),
+        "saved": sum(result["saved"] for result in succeeded),
+    }
+
+
+@Instrumentation.traced("remove-pre-and-suf", is_stage=True)
+def remove_pre_and_suf(directory, progress=None, snapshot=None):
+    snapshot = snapshot or DirectorySnapshot()
+    filenames = sorted(snapshot.names(directory))
+    for done, filename in enumerate(filenames, start=1):
         new_filename = filename.replace('compressed_', '').replace('_merged', '')
         if new_filename != filename:
             os.rename(os.path.join(directory, filename), os.path.join(directory, new_filename))
+            snapshot.move(os.path.join(directory, filename), os.path.join(directory, new_filename))
+        report_progress(progress, done, len(filenames), filename)
 
 
 def delete_files_and_folders(folder_path: str):
@@ -1,9 +1,14 @@
+import os
 import re
-import pypdf
-import pdfrw
+
+import PdfTextCache
+
+# pypdf and pdfrw are imported where they're used, so importing this module (e.g. at startup) stays cheap
 
 
 def write_to_pdf(filename, work_order_num, address, description):
+    import pdfrw
+
     # Read the PDF file
     pdf = pdfrw.PdfReader(filename)
 
@@ -24,45 +29,204 @@ def write_to_pdf(filename, work_order_num, address, description):
     pdfrw.PdfWriter().write(filename, pdf)
 
 
+_templates = {}  # Parsed fillable templates of this process, keyed by path and modification time
+
+
+def load_template(template_path):
+    import pdfrw
+
+    key = (os.path.abspath(template_path), os.path.getmtime(template_path))
+    if key not in _templates:
+        _templates.clear()
+        _templates[key] = pdfrw.PdfReader(template_path)
+    return _templates[key]
+
+
+def fill_template(template_path, output_filename, work_order_num, address, description):
+    import pdfrw
+
+    # The parsed template is shared by every order, so fields are filled, written out and then put back
+    pdf = load_template(template_path)
+    values = {"(Work Order #)": work_order_num, "(Address)": address, "(Description)": description}
+    filled = []
+    try:
+        for field in pdf.Root.AcroForm.Fields:
+            if not field.V and field.T in values:
+                filled.append((field, field.V))
+                field.V = values[field.T]
+        pdfrw.PdfWriter().write(output_filename, pdf)
+    finally:
+        for field, value in filled:
+            field.V = value
+
+
 def get_pdf_info(filename):
+    return PdfTextCache.cached_field(filename, 'pdf_info', lambda: parse_pdf_info(filename))
+
+
+def parse_pdf_info(filename):
+    work_order_text = ""
+    location_text = ""
+    description_text = ""
+    for page_text in PdfTextCache.iter_page_texts(filename):
+        work_order_match = re.search(r'Work Order #(.*?)Request By', page_text, re.DOTALL)
+        if work_order_match:
+            work_order_text = work_order_match.group(1).strip()
+        location_match = re.search(r'Location.*?Location(.*?)Description', page_text, re.DOTALL)
+        if location_match:
+            location_text = location_match.group(1).strip().split(",")
+        description_match = re.search(r'Description(?! of Work)(.*?)Closing Comments', page_text, re.DOTALL)
+        if description_match:
+            description_text = description_match.group(1).strip()
+        if work_order_text and location_text and description_text:
+            break
+
+    return [location_text[0], description_text]
+
+
+DATE_FORMAT_PATTERN = r"\d{1,2}/\d{1,2}/\d{1,2}"
+WORK_ORDER_NUMBER_PATTERN = re.compile(r'Work Order #[ \t]*\n?[ \t]*(\d+)')
+CONTENT_SCAN_LIMIT = 256 * 1024  # Bytes of the first page's decompressed content stream searched by the fast path
+LITERAL_ESCAPES = {ord('n'): '\n', ord('r'): '\r', ord('t'): '\t', ord('b'): '\b', ord('f'): '\f'}
+
+
+def find_work_order_number_fast(filename):
+    import pypdf
+
+    # Search the strings drawn on the first page straight from its content stream, skipping layout analysis
     with open(filename, 'rb') as file:
         pdf_reader = pypdf.PdfReader(file)
-        work_order_text = ""
-        location_text = ""
-        description_text = ""
-        for page in range(len(pdf_reader.pages)):
-            if work_order_text and location_text and description_text:
+        if not pdf_reader.pages:
+            return None
+        contents = pdf_reader.pages[0].get_contents()
+        if contents is None:
+            return None
+        data = contents.get_data()[:CONTENT_SCAN_LIMIT]
+    match = WORK_ORDER_NUMBER_PATTERN.search(content_stream_text(data))
+    return match.group(1) if match else None
+
+
+def content_stream_text(data):
+    """Text of the string operands in a content stream, one line per Tj/TJ, good enough for simple fonts"""
+    parts = []
+    i = 0
+    in_array = False
+    while i < len(data):
+        c = data[i]
+        if c == 0x28:  # (literal string)
+            text, i = read_literal_string(data, i + 1)
+            parts.append(text)
+            if not in_array:
+                parts.append('\n')
+            continue
+        if c == 0x3C and data[i + 1:i + 2] != b'<':  # <hex string>, but not a << dictionary
+            end = data.find(b'>', i)
+            if end == -1:
                 break
-            page_text = pdf_reader.pages[page].extract_text()
-            work_order_match = re.search(r'Work Order #(.*?)Request By', page_text, re.DOTALL)
-            if work_order_match:
-                work_order_text = work_order_match.group(1).strip()
-            location_match = re.search(r'Location.*?Location(.*?)Description', page_text, re.DOTALL)
-            if location_match:
-                location_text = location_match.group(1).strip().split(",")
-            description_match = re.search(r'Description(?! of Work)(.*?)Closing Comments', page_text, re.DOTALL)
-            if description_match:
-                description_text = description_match.group(1).strip()
+            hex_digits = re.sub(rb'\s', b'', data[i + 1:end])
+            try:
+                parts.append(bytes.fromhex((hex_digits + b'0' * (len(hex_digits) % 2)).decode('ascii'))
+                             .decode('latin-1'))
+            except ValueError:
+                pass
+            if not in_array:
+                parts.append('\n')
+            i = end + 1
+            continue
+        if c == 0x5B:  # [ starts a TJ array, whose pieces belong to one run of text
+            in_array = True
+        elif c == 0x5D:
+            in_array = False
+            parts.append('\n')
+        elif c == 0x25:  # % comment
+            end = data.find(b'\n', i)
+            i = len(data) if end == -1 else end
+            continue
+        elif in_array and (c == 0x2D or 0x30 <= c <= 0x39 or c == 0x2E):
+            # A large negative kerning inside TJ is how generators usually draw a space
+            match = re.match(rb'-?\d*\.?\d+', data[i:i + 16])
+            if match:
+                if float(match.group()) < -150:
+                    parts.append(' ')
+                i += len(match.group())
+                continue
+        i += 1
+    return ''.join(parts)
 
-    return [location_text[0], description_text]
+
+def read_literal_string(data, i):
+    chars = []
+    depth = 1
+    while i < len(data):
+        c = data[i]
+        if c == 0x5C:  # backslash escape
+            i += 1
+            if i >= len(data):
+                break
+            c = data[i]
+            if c in LITERAL_ESCAPES:
+                chars.append(LITERAL_ESCAPES[c])
+            elif 0x30 <= c <= 0x37:
+                octal = re.match(rb'[0-7]{1,3}', data[i:i + 3]).group()
+                chars.append(chr(int(octal, 8) & 0xFF))
+                i += len(octal)
+                continue
+            elif c not in (0x0A, 0x0D):  # a backslash before a line break continues the string
+                chars.append(chr(c))
+        elif c == 0x28:
+            depth += 1
+            chars.append('(')
+        elif c == 0x29:
+            depth -= 1
+            if depth == 0:
+                return ''.join(chars), i + 1
+            chars.append(')')
+        else:
+            chars.append(chr(c))
+        i += 1
+    return ''.join(chars), i
 
 
 def read_compressed_pdf(filename):
+    import pypdf
+
     pdf_text = pypdf.PdfReader(filename)
     print(pdf_text.pages[2].extract_text())
 
 
 def get_work_hours(filename):
-    pdf_file = pypdf.PdfReader(filename)
-    num_pages_to_check = min(3, len(pdf_file.pages))
+    return PdfTextCache.cached_field(filename, 'work_hours', lambda: parse_work_hours(filename))
+
+
+def parse_work_hours(filename):
+    second_line = find_work_hours_line(filename)
+    return second_line.split(' ')[1:] if second_line is not None else None
+
+
+def get_work_hours_record(filename):
+    return PdfTextCache.cached_field(filename, 'work_hours_record', lambda: parse_work_hours_record(filename))
+
+
+def parse_work_hours_record(filename):
+    second_line = find_work_hours_line(filename)
+    if second_line is None:
+        return None
+    hours = second_line.split(' ')[1:]
+    date_match = re.search(r'\S*' + DATE_FORMAT_PATTERN + r'\S*', second_line)
+    return {
+        "date": date_match.group() if date_match else "",
+        "time_in": hours[0] if hours else "",
+        "time_out": hours[1] if len(hours) > 1 else "",
+        "hours": hours,
+    }
+
 
-    for page_num in range(num_pages_to_check):
-        page_text = pdf_file.pages[page_num].extract_text()
+def find_work_hours_line(filename):
+    for page_text in PdfTextCache.iter_page_texts(filename, max_pages=3):
         lines = page_text.strip().split('\n')
 
         if len(lines) >= 2:
             second_line = lines[1]
-            date_format_pattern = r"\d{1,2}/\d{1,2}/\d{1,2}"
-            if re.search(date_format_pattern, second_line):
-                return second_line.split(' ')[1:]
+            if re.search(DATE_FORMAT_PATTERN, second_line):
+                return second_line
     return None
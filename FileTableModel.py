@@ -0,0 +1,165 @@
+"""
+Table model behind the file list of the main window.
+
+Rows are plain lists whose first column (the file name) is the row key. The
+view only ever sees rows that were fetched in batches through
+canFetchMore/fetchMore, and set_rows applies the difference to the current
+rows (removed, changed and added rows) rather than resetting the model, so
+selection and scroll position survive a refresh. Only new columns, such as
+switching to the work hours or search results, reset it. Sorting and filtering go
+through a QSortFilterProxyModel on top of this model, which keeps only an
+index mapping and never copies rows.
+"""
+
+from PySide6.QtCore import QAbstractTableModel, QModelIndex, QSortFilterProxyModel, Qt
+
+DEFAULT_HEADERS = ["Files in directory", "Time in", "Time Out"]
+
+
+class FileTableModel(QAbstractTableModel):
+    BATCH_SIZE = 500
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.headers = list(DEFAULT_HEADERS)
+        self.folder = ""
+        self._rows = []
+        self._positions = {}  # file name -> index in self._rows
+        self._loaded = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        row = self._rows[index.row()]
+        return row[index.column()] if index.column() < len(row) else ""
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal and section < len(self.headers):
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._loaded < len(self._rows)
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(self.BATCH_SIZE, len(self._rows) - self._loaded)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + count - 1)
+        self._loaded += count
+        self.endInsertRows()
+
+    def fetch_all(self):
+        while self.canFetchMore():
+            self.fetchMore()
+
+    def key(self, row):
+        return self._rows[row][0]
+
+    def set_rows(self, rows, folder=None, headers=None):
+        if folder is not None:
+            self.folder = folder
+        if headers is not None and list(headers) != self.headers:
+            # Other columns can't be patched in row by row, the view has to start over with them
+            self.beginResetModel()
+            self.headers = list(headers)
+            self._set_all(self._normalize(row) for row in rows)
+            self.endResetModel()
+            return
+        new_rows = {}
+        for row in rows:
+            row = self._normalize(row)
+            new_rows[row[0]] = row
+
+        # Switching to an unrelated listing: nothing to keep, so a reset is cheaper than a diff
+        if not any(name in new_rows for name in self._positions):
+            self.beginResetModel()
+            self._set_all(new_rows.values())
+            self.endResetModel()
+            return
+
+        removed = [position for position, row in enumerate(self._rows) if row[0] not in new_rows]
+        self._remove_positions(removed)
+        for position, row in enumerate(self._rows):
+            self._replace(position, new_rows.pop(row[0]))
+        self.add_rows(new_rows.values())
+
+    def add_rows(self, rows):
+        rows = [self._normalize(row) for row in rows]
+        rows = [row for row in rows if row[0] not in self._positions]
+        if not rows:
+            return
+        start = len(self._rows)
+        fully_loaded = self._loaded == start
+        self._rows.extend(rows)
+        for position in range(start, len(self._rows)):
+            self._positions[self._rows[position][0]] = position
+        # Rows only become visible right away when the view already shows everything; otherwise fetchMore brings them
+        if fully_loaded:
+            self.fetchMore()
+
+    def remove_names(self, names):
+        self._remove_positions(sorted(self._positions[name] for name in names if name in self._positions))
+
+    def rename(self, old_name, new_name):
+        position = self._positions.get(old_name)
+        if position is None or new_name in self._positions:
+            return
+        row = list(self._rows[position])
+        row[0] = new_name
+        del self._positions[old_name]
+        self._positions[new_name] = position
+        self._replace(position, row)
+
+    def _set_all(self, rows):
+        self._rows = list({row[0]: row for row in rows}.values())
+        self._loaded = min(self.BATCH_SIZE, len(self._rows))
+        self._reindex()
+
+    def _normalize(self, row):
+        row = [str(value) if value is not None else "" for value in row][:len(self.headers)]
+        return row + [""] * (len(self.headers) - len(row))
+
+    def _replace(self, position, row):
+        if self._rows[position] == row:
+            return
+        self._rows[position] = row
+        if position < self._loaded:
+            self.dataChanged.emit(self.index(position, 0), self.index(position, len(self.headers) - 1))
+
+    def _remove_positions(self, positions):
+        # Remove contiguous runs from the bottom up so earlier positions stay valid
+        runs = []
+        for position in positions:
+            if runs and runs[-1][1] == position - 1:
+                runs[-1][1] = position
+            else:
+                runs.append([position, position])
+        for first, last in reversed(runs):
+            visible_last = min(last, self._loaded - 1)
+            if first <= visible_last:
+                self.beginRemoveRows(QModelIndex(), first, visible_last)
+                del self._rows[first:last + 1]
+                self._loaded -= visible_last - first + 1
+                self.endRemoveRows()
+            else:
+                del self._rows[first:last + 1]
+        if runs:
+            self._reindex()
+
+    def _reindex(self):
+        self._positions = {row[0]: position for position, row in enumerate(self._rows)}
+
+
+class FileFilterProxyModel(QSortFilterProxyModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.setFilterKeyColumn(0)
+        self.setSortCaseSensitivity(Qt.CaseInsensitive)
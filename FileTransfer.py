@@ -0,0 +1,279 @@
+"""
+Cheap file copies for the Job Images backups, and moves to the Move Folder.
+
+A backup only has to survive the merge deleting the photos, it's never
+edited, so it doesn't need its own copy of the bytes. In order of
+preference a backup is:
+    reflink          copy-on-write clone (FICLONE on btrfs, XFS, bcachefs, ...)
+    hardlink         a second name for the same file
+    copy_file_range  copy done by the kernel, which may share extents on its own
+    sendfile         kernel copy without going through Python buffers
+    copy             shutil.copy2
+What the Work Folder's filesystem supports is found out once per folder with
+a scratch file, instead of failing over for every photo.
+
+Moves to a Move Folder on another drive (typically a mapped network share)
+are copies plus deletes. transfer_files runs a few of them at once with large
+buffers, so one file's round trips overlap another's, copies to a ".part"
+name, checks the size that arrived before renaming it into place, and only
+then deletes the source. Files are opened through an opener (open by
+default), so a slow share can be stood in for by ThrottledOpener locally.
+"""
+
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from WorkerPool import run_pool
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h
+BACKUP_MODES = ["reflink", "hardlink", "copy_file_range", "sendfile", "copy"]
+CHUNK_SIZE = 8 * 1024 * 1024
+
+TRANSFER_BUFFER_SIZE = 4 * 1024 * 1024  # SMB reads and writes up to a few MB per request
+TRANSFER_WORKERS = 4
+PART_SUFFIX = ".part"
+
+_backup_modes = {}
+
+
+def reflink(source, destination):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    try:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+    shutil.copystat(source, destination)
+
+
+def hardlink(source, destination):
+    os.link(source, destination)
+
+
+def _kernel_copy(source, destination, copy_chunk):
+    try:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            remaining = os.fstat(src.fileno()).st_size
+            offset = 0
+            while remaining > 0:
+                copied = copy_chunk(src.fileno(), dst.fileno(), offset, min(remaining, CHUNK_SIZE))
+                if copied == 0:
+                    break
+                offset += copied
+                remaining -= copied
+    except OSError:
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+    shutil.copystat(source, destination)
+
+
+def copy_file_range(source, destination):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError("copy_file_range is not available")
+    _kernel_copy(source, destination,
+                 lambda src, dst, offset, count: os.copy_file_range(src, dst, count, offset, offset))
+
+
+def sendfile(source, destination):
+    if not hasattr(os, "sendfile") or os.name == "nt":
+        raise OSError("sendfile to a file is not available")
+    # sendfile advances the destination's own position, so only the source offset is passed
+    _kernel_copy(source, destination, lambda src, dst, offset, count: os.sendfile(dst, src, offset, count))
+
+
+def copy(source, destination):
+    shutil.copy2(source, destination)
+
+
+BACKUP_FUNCTIONS = {"reflink": reflink, "hardlink": hardlink, "copy_file_range": copy_file_range,
+                    "sendfile": sendfile, "copy": copy}
+
+
+def detect_backup_mode(root):
+    """The cheapest backup mode that works in root, found with a scratch file on the first call for that folder"""
+    key = os.path.normcase(os.path.abspath(root))
+    if key in _backup_modes:
+        return _backup_modes[key]
+
+    mode = "copy"
+    fd, probe = tempfile.mkstemp(prefix=".backup-probe-", dir=root)
+    try:
+        os.write(fd, b"probe")
+        os.close(fd)
+        target = probe + ".backup"
+        for candidate in BACKUP_MODES[:-1]:
+            try:
+                BACKUP_FUNCTIONS[candidate](probe, target)
+                mode = candidate
+                break
+            except OSError:
+                pass
+            finally:
+                if os.path.exists(target):
+                    os.remove(target)
+    finally:
+        os.remove(probe)
+    _backup_modes[key] = mode
+    return mode
+
+
+def backup_file(source, destination, mode="copy"):
+    """Back source up to destination with mode, moving down the list if it fails for this file; returns the mode used"""
+    for candidate in BACKUP_MODES[BACKUP_MODES.index(mode):]:
+        if os.path.lexists(destination):
+            os.remove(destination)  # A backup left over from an earlier run; os.link won't replace it
+        try:
+            BACKUP_FUNCTIONS[candidate](source, destination)
+            return candidate
+        except OSError:
+            # e.g. a photo on another device than the probe, or a filesystem's hard link limit
+            if candidate == "copy":
+                raise
+
+
+def is_same_device(source, destination_folder):
+    try:
+        return os.stat(source).st_dev == os.stat(destination_folder).st_dev
+    except OSError:
+        return False
+
+
+def copy_verified(source, destination, buffer_size=TRANSFER_BUFFER_SIZE, opener=open):
+    """Copy source to destination through a ".part" file and return the bytes copied; raises OSError on a short copy"""
+    part = destination + PART_SUFFIX
+    try:
+        copied = 0
+        with opener(source, "rb") as src, opener(part, "wb") as dst:
+            expected = os.fstat(src.fileno()).st_size
+            while True:
+                chunk = src.read(buffer_size)
+                if not chunk:
+                    break
+                dst.write(chunk)
+                copied += len(chunk)
+        arrived = os.path.getsize(part)
+        if copied != expected or arrived != expected:
+            raise OSError(f"{os.path.basename(source)}: copied {arrived} of {expected} bytes")
+        shutil.copystat(source, part)
+        os.replace(part, destination)
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+    return copied
+
+
+def move_file(source, destination, buffer_size=TRANSFER_BUFFER_SIZE, opener=open, same_device=None):
+    """Move source to destination: a rename on the same drive, otherwise a verified copy and a delete"""
+    start = time.perf_counter()
+    if same_device is None:
+        same_device = is_same_device(source, os.path.dirname(destination) or ".")
+    if same_device:
+        os.replace(source, destination)
+        size, method = os.path.getsize(destination), "rename"
+    else:
+        size, method = copy_verified(source, destination, buffer_size, opener), "copy"
+        os.remove(source)
+    return {"file": os.path.basename(source), "bytes": size, "method": method,
+            "seconds": round(time.perf_counter() - start, 4), "error": None}
+
+
+def transfer_files(moves, workers=TRANSFER_WORKERS, buffer_size=TRANSFER_BUFFER_SIZE, opener=open, progress=None,
+                   same_device=None, wrap=None, on_moved=None):
+    """
+    Move (source, destination) pairs with up to workers copies at once and return a report with the throughput.
+    wrap(source, destination) may return a context manager each move runs in, e.g. a journal operation.
+    progress(done, total, item) and on_moved(source, destination, result) are called from the calling thread.
+    """
+    start = time.perf_counter()
+    results = []
+
+    def run(source, destination):
+        try:
+            with wrap(source, destination) if wrap else contextlib.nullcontext():
+                return move_file(source, destination, buffer_size, opener, same_device)
+        except OSError as e:
+            return {"file": os.path.basename(source), "bytes": 0, "method": None, "seconds": None,
+                    "error": f"{type(e).__name__}: {e}"}
+
+    with run_pool(run, moves, max(1, workers), ThreadPoolExecutor) as completed:
+        for done, ((source, destination), result) in enumerate(completed, start=1):
+            results.append(result)
+            if on_moved and not result["error"]:
+                on_moved(source, destination, result)
+            if progress:
+                progress(done, len(moves), result["file"])
+
+    seconds = time.perf_counter() - start
+    moved = sum(result["bytes"] for result in results if not result["error"])
+    return {"files": sum(1 for result in results if not result["error"]),
+            "failed": sum(1 for result in results if result["error"]),
+            "renamed": sum(1 for result in results if result["method"] == "rename"),
+            "copied": sum(1 for result in results if result["method"] == "copy"),
+            "bytes": moved, "seconds": round(seconds, 3),
+            "mb_per_second": round(moved / 2 ** 20 / seconds, 2) if seconds else None,
+            "workers": workers, "buffer_size": buffer_size, "results": results}
+
+
+class ThrottledFile:
+    def __init__(self, file, opener):
+        self._file = file
+        self._opener = opener
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self._opener.delay(len(data))
+        return data
+
+    def write(self, data):
+        self._opener.delay(len(data))
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+        return False
+
+
+class ThrottledOpener:
+    """
+    Stand-in for a network share: every open costs latency seconds and the
+    bytes read and written share bytes_per_second, like one link to the server.
+    """
+
+    def __init__(self, bytes_per_second=10 * 2 ** 20, latency=0.02):
+        self.bytes_per_second = bytes_per_second
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._free_at = 0.0
+
+    def delay(self, size):
+        # Each request waits for the link and for its own round trip, so concurrent copies overlap their latency
+        with self._lock:
+            now = time.monotonic()
+            self._free_at = max(self._free_at, now) + size / self.bytes_per_second
+            wait = self._free_at - now
+        time.sleep(wait + self.latency)
+
+    def __call__(self, path, mode="r"):
+        time.sleep(self.latency)
+        return ThrottledFile(open(path, mode), self)
@@ -0,0 +1,133 @@
+"""
+Watches the Work Folder and Move Folder and reports what changed in them.
+
+Change notifications come from QFileSystemWatcher (inotify on Linux,
+ReadDirectoryChangesW on Windows). Folders the watcher can't follow, and
+network shares, which often never send notifications, are polled instead.
+Bursts of notifications are coalesced behind a short debounce. After that
+only the changed folder is listed again and compared with its previous
+listing, and the result is reported as added, removed and renamed entries,
+so the window can patch its table without rebuilding it.
+"""
+
+import os
+
+from PySide6.QtCore import QFileSystemWatcher, QObject, QTimer, Signal
+
+DEBOUNCE_MS = 300
+POLL_MS = 5000
+
+
+def entry_identity(entry):
+    # Lets a rename be told apart from a delete plus an add. The inode is free from scandir on POSIX,
+    # while on Windows size and mtime are free and the file index would cost an extra stat.
+    try:
+        if os.name == 'nt':
+            stat = entry.stat()
+            return stat.st_size, stat.st_mtime_ns, entry.is_dir()
+        return entry.inode()
+    except OSError:
+        return None
+
+
+def list_folder(folder):
+    try:
+        return {entry.name: entry_identity(entry) for entry in os.scandir(folder)}
+    except OSError:
+        return None
+
+
+def list_folders(folders):
+    """Listings for set_folders(), to be taken off the GUI thread since a network share can take seconds"""
+    return {os.path.normpath(folder): list_folder(folder) for folder in folders if folder}
+
+
+def diff_listings(old, new):
+    added = [name for name in new if name not in old]
+    removed = [name for name in old if name not in new]
+    renamed = []
+    removed_by_identity = {}
+    for name in removed:
+        if old[name] is not None:
+            removed_by_identity.setdefault(old[name], []).append(name)
+    for name in list(added):
+        candidates = removed_by_identity.get(new[name])
+        if candidates:
+            old_name = candidates.pop(0)
+            renamed.append((old_name, name))
+            added.remove(name)
+            removed.remove(old_name)
+    return added, removed, renamed
+
+
+class FolderWatcher(QObject):
+    changed = Signal(str, list, list, list)  # folder, added names, removed names, [(old name, new name)]
+
+    def __init__(self, parent=None, debounce_ms=DEBOUNCE_MS, poll_ms=POLL_MS):
+        super().__init__(parent)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self._directory_changed)
+        self.listings = {}
+        self.polled = set()
+        self.dirty = set()
+
+        self.debounce = QTimer(self)
+        self.debounce.setSingleShot(True)
+        self.debounce.setInterval(debounce_ms)
+        self.debounce.timeout.connect(self.flush)
+
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(poll_ms)
+        self.poll_timer.timeout.connect(self._poll)
+
+    def set_folders(self, folders, listings=None):
+        # Folders listed by list_folders() aren't listed again here, one that couldn't be listed isn't watched
+        listings = listings or {}
+        folders = {os.path.normpath(folder) for folder in folders if folder}
+        folders = {folder for folder in folders
+                   if (listings[folder] is not None if folder in listings else os.path.isdir(folder))}
+        for folder in set(self.listings) - folders:
+            self.watcher.removePath(folder)
+            self.polled.discard(folder)
+            del self.listings[folder]
+
+        for folder in folders - set(self.listings):
+            self.listings[folder] = listings[folder] if folder in listings else list_folder(folder) or {}
+            is_network_share = folder.startswith(('\\\\', '//'))
+            if is_network_share or not self.watcher.addPath(folder):
+                self.polled.add(folder)
+
+        if self.polled:
+            self.poll_timer.start()
+        else:
+            self.poll_timer.stop()
+
+    def _directory_changed(self, path):
+        self.dirty.add(os.path.normpath(path))
+        self.debounce.start()  # Restarts the countdown, so a burst of events is handled once
+
+    def _poll(self):
+        self.dirty.update(self.polled)
+        self.flush()
+
+    def flush(self):
+        self.debounce.stop()
+        dirty, self.dirty = self.dirty, set()
+        for folder in dirty:
+            if folder not in self.listings:
+                continue
+            listing = list_folder(folder)
+            if listing is None:
+                continue
+            added, removed, renamed = diff_listings(self.listings[folder], listing)
+            self.listings[folder] = listing
+            if folder not in self.polled and folder not in self.watcher.directories():
+                # Some platforms drop the watch when the folder is replaced, so put it back
+                self.watcher.addPath(folder)
+            if added or removed or renamed:
+                self.changed.emit(folder, added, removed, renamed)
+
+    def refresh(self, folder=None):
+        # Check a folder right away, e.g. after a job changed it, instead of waiting for the next notification
+        self.dirty.update([os.path.normpath(folder)] if folder else self.listings)
+        self.flush()
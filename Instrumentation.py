@@ -0,0 +1,338 @@
+"""
+Timing spans, counters and profiling for the work order pipeline.
+
+Stages and the per-file operations inside them (parse, extract, convert,
+merge, gs calls, moves) run inside named spans. Spans nest per thread, and
+each one is written as a line of JSON when it ends, with its duration, its
+parent and the counters (bytes read and written, files processed) that were
+counted while it was open. Counters roll up into the enclosing span, so a
+stage's line holds the totals of its files.
+
+Tracing is off unless it is switched on:
+    WOM_TRACE=1            trace to trace.jsonl in the user cache folder
+    WOM_TRACE=<path>       trace to that file
+    WOM_PROFILE=<stage>    run cProfile over that stage (e.g. merge) and save <stage>.prof next to the trace
+or from the window. Worker processes append to the same trace file, every
+line carries the pid. cProfile only sees the thread running the stage, so
+the work done in pool workers shows up as waiting on futures.
+"""
+
+import atexit
+import cProfile
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from CacheHandling import get_user_cache_dir
+
+TRACE_ENV = 'WOM_TRACE'
+PROFILE_ENV = 'WOM_PROFILE'
+TRACE_FILE = 'trace.jsonl'
+RSS_SAMPLE_INTERVAL = 0.05
+
+_lock = threading.Lock()
+_local = threading.local()
+_ids = itertools.count(1)
+_trace_file = None
+_trace_path = None
+_profile_stage = None
+_counters = {}
+_process = None  # psutil.Process of this process, False without psutil; looked up on the first rss()
+
+
+def default_trace_path():
+    return os.path.join(get_user_cache_dir(), TRACE_FILE)
+
+
+def configure(trace_path=None, profile_stage=None):
+    """Start or stop tracing and choose the stage to profile. Worker processes started later follow along."""
+    global _trace_file, _trace_path, _profile_stage
+    with _lock:
+        if _trace_file:
+            _trace_file.close()
+        _trace_path = trace_path or None
+        _trace_file = open(trace_path, 'a', encoding='utf-8', buffering=1) if trace_path else None
+        _profile_stage = profile_stage or None
+    # Pool workers import this module on their own and pick the settings up from the environment
+    for variable, value in ((TRACE_ENV, trace_path), (PROFILE_ENV, profile_stage)):
+        if value:
+            os.environ[variable] = value
+        else:
+            os.environ.pop(variable, None)
+
+
+def configure_from_environment():
+    trace = os.environ.get(TRACE_ENV, '').strip()
+    if trace.lower() in ('', '0', 'false', 'off'):
+        trace = None
+    elif trace.lower() in ('1', 'true', 'on'):
+        trace = default_trace_path()
+    configure(trace, os.environ.get(PROFILE_ENV, '').strip() or None)
+
+
+def trace_path():
+    return _trace_path
+
+
+def profile_stage():
+    return _profile_stage
+
+
+def is_tracing():
+    return _trace_file is not None
+
+
+def _write(event):
+    line = json.dumps(event, default=str) + '\n'
+    with _lock:
+        if _trace_file:
+            _trace_file.write(line)
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class Span:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.counters = {}
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = _stack()
+        self.parent = stack[-1].id if stack else None
+        self.id = next(_ids)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._started
+        stack = _stack()
+        stack.pop()
+        if stack:
+            parent_counters = stack[-1].counters
+            for name, value in self.counters.items():
+                parent_counters[name] = parent_counters.get(name, 0) + value
+        event = {"type": "span", "name": self.name, "id": self.id, "parent": self.parent, "pid": os.getpid(),
+                 "thread": threading.current_thread().name, "start": round(self.start, 6),
+                 "seconds": round(seconds, 6)}
+        event.update(self.attributes)
+        if self.counters:
+            event["counters"] = self.counters
+        if exc_type:
+            event["error"] = exc_type.__name__
+        _write(event)
+        return False
+
+
+class _NullSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(name, **attributes):
+    # Costs one check when tracing is off
+    return Span(name, attributes) if _trace_file else NULL_SPAN
+
+
+def profile_path(stage_name):
+    folder = os.path.dirname(_trace_path) if _trace_path else get_user_cache_dir()
+    return os.path.join(folder, f"{stage_name}.prof")
+
+
+@contextmanager
+def stage(name, **attributes):
+    profiler = None
+    if _profile_stage == name:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with span(name, stage=True, **attributes) as current:
+            yield current
+    finally:
+        if profiler:
+            profiler.disable()
+            path = profile_path(name)
+            profiler.dump_stats(path)
+            log("Profile written", stage=name, path=path)
+
+
+def traced(name, is_stage=False):
+    """Decorator running every call of the function inside a span, or inside stage() for pipeline stages"""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name) if is_stage else span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        counters = stack[-1].counters
+        counters[name] = counters.get(name, 0) + value
+
+
+def count_file(path, counter='bytes_read'):
+    try:
+        count(counter, os.path.getsize(path))
+    except OSError:
+        pass
+
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+
+def log(message, **attributes):
+    if not _trace_file:
+        return
+    stack = _stack()
+    event = {"type": "log", "message": message, "time": round(time.time(), 6), "pid": os.getpid(),
+             "span": stack[-1].id if stack else None}
+    event.update(attributes)
+    _write(event)
+
+
+def rss(include_children=False):
+    """Resident set size of this process in bytes, with its worker processes if asked, or None where it can't be read"""
+    global _process
+    if _process is None:
+        try:
+            import psutil
+            _process = psutil.Process()
+        except ImportError:
+            _process = False
+    if _process:
+        return _process.memory_info().rss + (_psutil_children_rss() if include_children else 0)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') + (
+                _proc_children_rss() if include_children else 0)
+    except (OSError, ValueError, AttributeError):
+        pass
+    if os.name == 'nt':
+        return _windows_rss()  # Without psutil only this process is counted
+    return None
+
+
+def _psutil_children_rss():
+    import psutil
+
+    total = 0
+    for child in _process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass  # Exited since it was listed
+    return total
+
+
+def _proc_children_rss():
+    # Pool workers are children of whichever thread started the pool
+    pids = []
+    for task in os.listdir('/proc/self/task'):
+        try:
+            with open(f'/proc/self/task/{task}/children') as f:
+                pids += f.read().split()
+        except OSError:
+            pass
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/statm') as f:
+                total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            pass
+    return total
+
+
+def _windows_rss():
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None
+    return counters.WorkingSetSize
+
+
+class PeakRss:
+    """Samples rss() from a background thread while the block runs; peak is the highest value seen, in bytes"""
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL, include_children=False):
+        self.interval = interval
+        self.include_children = include_children
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _sample(self):
+        value = rss(self.include_children)
+        if value is not None and (self.peak is None or value > self.peak):
+            self.peak = value
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return False
+
+
+@atexit.register
+def _close():
+    global _trace_file
+    if _trace_file and _counters:
+        _write({"type": "counters", "pid": os.getpid(), "time": round(time.time(), 6), "counters": counters()})
+    with _lock:
+        if _trace_file:
+            _trace_file.close()
+            _trace_file = None
+
+
+configure_from_environment()
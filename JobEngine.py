@@ -0,0 +1,109 @@
+"""
+Runs work order pipelines off the GUI thread.
+
+A Job is a list of named stages. Each stage is a callable that receives a
+progress callback and passes it on to the FileArrangement function it
+wraps. The callback forwards per-item progress to the window through Qt
+signals and raises JobCancelled once cancellation was requested, so a job
+stops between two items and never in the middle of one.
+
+Jobs run one at a time in submission order, so a second job waits behind
+the running one.
+"""
+
+import threading
+import traceback
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+import Instrumentation
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobSignals(QObject):
+    stage_started = Signal(str, int, int)  # stage name, stage index, stage count
+    progress = Signal(int, int, str)  # items done, item count, current item
+    finished = Signal(object, object)  # job, {stage name: stage result}
+    failed = Signal(object, str, str)  # job, error message, formatted traceback
+    cancelled = Signal(object)  # job
+
+
+class Job(QRunnable):
+    def __init__(self, name, stages, on_finished=None):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.name = name
+        self.stages = stages
+        self.on_finished = on_finished
+        self.signals = JobSignals()
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def progress(self, done, total, item=None):
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.signals.progress.emit(done, total, "" if item is None else str(item))
+
+    def run(self):
+        results = {}
+        try:
+            with Instrumentation.span("job", job=self.name):
+                for index, (stage_name, stage) in enumerate(self.stages):
+                    if self._cancel.is_set():
+                        raise JobCancelled()
+                    self.signals.stage_started.emit(stage_name, index, len(self.stages))
+                    results[stage_name] = stage(self.progress)
+        except JobCancelled:
+            self.signals.cancelled.emit(self)
+        except Exception as e:
+            details = traceback.format_exc()
+            Instrumentation.log("Job failed", job=self.name, traceback=details)
+            self.signals.failed.emit(self, f"{type(e).__name__}: {e}", details)
+        else:
+            self.signals.finished.emit(self, results)
+
+
+class JobEngine(QObject):
+    queue_changed = Signal(int)  # number of jobs running or waiting
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(1)
+        self.jobs = []
+
+    def submit(self, job):
+        self.jobs.append(job)
+        job.signals.finished.connect(self._job_done)
+        job.signals.failed.connect(self._job_done)
+        job.signals.cancelled.connect(self._job_done)
+        self.pool.start(job)
+        self.queue_changed.emit(len(self.jobs))
+        return job
+
+    def _job_done(self, job, *args):
+        if job in self.jobs:
+            self.jobs.remove(job)
+        self.queue_changed.emit(len(self.jobs))
+
+    def current_job(self):
+        return self.jobs[0] if self.jobs else None
+
+    def cancel_all(self):
+        # Jobs that haven't started yet are simply taken off the queue
+        for job in list(self.jobs[1:]):
+            if self.pool.tryTake(job):
+                job.signals.cancelled.emit(job)
+        if self.jobs:
+            self.jobs[0].cancel()
+
+    def is_busy(self):
+        return bool(self.jobs)
+
+    def wait(self, msecs=-1):
+        return self.pool.waitForDone(msecs)
@@ -0,0 +1,45 @@
+"""
+The SQLite files the app keeps in the user folders, and the reads that fill them.
+
+PdfTextCache, WorkHoursStore and SearchIndex each keep one Database. Its
+connections are per thread, since a sqlite connection can't be shared
+between threads, and per process: a pool worker forked from a process that
+had a connection open inherits it, and must open its own instead.
+read_all() reads the new and changed files of an update, in a process pool
+when there is more than one.
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+
+from WorkerPool import run_pool
+
+
+class Database:
+    def __init__(self, get_path, setup):
+        # setup(connection) creates the schema, get_path is only called once a connection is needed
+        self._get_path = get_path
+        self._setup = setup
+        self._local = threading.local()
+
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._get_path(), timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._setup(connection)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+
+@contextlib.contextmanager
+def read_all(function, paths, workers=None):
+    """Gives an iterator of function(path) for every path, in completion order; stops the pool when the block exits"""
+    if len(paths) <= 1:
+        yield (function(path) for path in paths)  # Not worth starting a pool for
+        return
+    with run_pool(function, [(path,) for path in paths], workers) as completed:
+        yield (result for args, result in completed)
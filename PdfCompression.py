@@ -0,0 +1,136 @@
+"""
+Compression of the merged work orders, with a choice of engine.
+
+Engines:
+    ghostscript  re-distills the PDF with gs at the PDFSETTINGS of the level
+    pypdf        runs in-process: recompresses content streams, drops
+                 identical objects and downsamples the photos, no gs needed
+
+Levels follow pdf_compressor (0 default, 1 prepress, 2 printer, 3 ebook,
+4 screen). compress_file applies the policy: files under a size threshold
+are left alone, a target size picks the level instead of the given one
+(and escalates while the output is still too big), and the output is only
+kept when it is smaller than the original.
+"""
+
+import os
+
+ENGINES = ["auto", "ghostscript", "pypdf"]
+DEFAULT_ENGINE = "auto"  # Ghostscript when it is installed, pypdf otherwise
+MIN_SIZE = 200 * 1024  # Files smaller than this aren't worth a compression run
+# Levels tried for a target size, from the mildest, with the rough output/input ratio each one gets on merged orders
+TARGET_LEVELS = [(0, 0.9), (2, 0.7), (3, 0.45), (4, 0.3)]
+# Longest image side and JPEG quality the pypdf engine downsamples photos to, per level
+IMAGE_LEVELS = {2: (2400, 85), 3: (1600, 75), 4: (1000, 60)}
+
+
+class GhostscriptEngine:
+    name = "ghostscript"
+    in_process = False  # gs does the work in its own process, so threads are enough to drive it
+
+    def __init__(self, gs=None):
+        # pdf_compressor imports FileArrangement, which imports this module, so it's only imported once it's used
+        from pdf_compressor import get_ghostscript_path
+        self.gs = gs or get_ghostscript_path()
+
+    def compress(self, input_path, output_path, level):
+        from pdf_compressor import compress
+        compress(input_path, output_path, level, self.gs)
+
+
+class PypdfEngine:
+    name = "pypdf"
+    in_process = True
+
+    def compress(self, input_path, output_path, level):
+        from pypdf import PdfWriter
+
+        writer = PdfWriter(clone_from=input_path)
+        max_side, quality = IMAGE_LEVELS.get(level, (None, None))
+        for page in writer.pages:
+            if max_side:
+                for image in page.images:
+                    downsample_image(image, max_side, quality)
+            page.compress_content_streams(level=9)
+        # Photos and form XObjects that were appended more than once end up as a single object
+        if hasattr(writer, "compress_identical_objects"):
+            writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+        with open(output_path, "wb") as f:
+            writer.write(f)
+
+
+def downsample_image(image, max_side, quality):
+    from PIL import Image
+
+    try:
+        pil_image = image.image
+        if max(pil_image.size) <= max_side:
+            return
+        pil_image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if pil_image.mode not in ("RGB", "L"):
+            pil_image = pil_image.convert("RGB")
+        image.replace(pil_image, quality=quality)
+    except Exception:
+        # Inline images, masks and unusual color spaces can't always be replaced; leave those as they are
+        pass
+
+
+def get_engine(name=DEFAULT_ENGINE):
+    if name in ("auto", "ghostscript"):
+        try:
+            return GhostscriptEngine()
+        except FileNotFoundError:
+            if name == "ghostscript":
+                raise
+    if name in ("auto", "pypdf"):
+        return PypdfEngine()
+    raise ValueError(f"Unknown compression engine: {name}")
+
+
+def candidate_levels(initial_size, power=0, target_size=None):
+    if not target_size:
+        return [power]
+    # Start at the mildest level expected to reach the target, then escalate to the stronger ones
+    needed_ratio = target_size / initial_size
+    levels = [level for level, ratio in TARGET_LEVELS]
+    start = next((index for index, (level, ratio) in enumerate(TARGET_LEVELS) if ratio <= needed_ratio),
+                 len(levels) - 1)
+    return levels[start:]
+
+
+def compress_file(input_path, output_path, engine, power=0, min_size=MIN_SIZE, target_size=None):
+    """Compress input_path into output_path and return what it saved; output_path is only written when it's smaller"""
+    initial_size = os.path.getsize(input_path)
+    result = {"file": os.path.basename(input_path), "engine": engine.name, "level": None,
+              "initial_size": initial_size, "final_size": initial_size, "saved": 0, "ratio": 0.0,
+              "kept_original": False, "skipped": None, "error": None}
+    if initial_size < min_size:
+        result["skipped"] = "below size threshold"
+        return result
+    if target_size and initial_size <= target_size:
+        result["skipped"] = "already within target size"
+        return result
+
+    best = None  # (size, level, path)
+    candidates = []
+    try:
+        for level in candidate_levels(initial_size, power, target_size):
+            candidate = f"{output_path}.level{level}.tmp"
+            candidates.append(candidate)
+            engine.compress(input_path, candidate, level)
+            size = os.path.getsize(candidate)
+            if best is None or size < best[0]:
+                best = (size, level, candidate)
+            if not target_size or size <= target_size:
+                break
+        if best and best[0] < initial_size:
+            os.replace(best[2], output_path)
+            result.update(level=best[1], final_size=best[0], saved=initial_size - best[0],
+                          ratio=1 - best[0] / initial_size)
+        else:
+            result["kept_original"] = True
+    finally:
+        for candidate in candidates:
+            if os.path.exists(candidate):
+                os.remove(candidate)
+    return result
@@ -0,0 +1,202 @@
+"""
+Persistent cache of text extracted from work order PDFs.
+
+Page text and parsed fields are stored in a SQLite database in the per-user
+cache folder, so a PDF is only parsed once no matter how many stages
+(rename, form fill, work hours) read it or how often the program restarts.
+
+Files are identified by path, size and modification time. When the content
+hash is enabled (the default) a file that was renamed or moved into its
+work order folder is still recognised by its bytes.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+import Instrumentation
+import LocalStore
+from CacheHandling import get_user_cache_dir
+
+CACHE_DB = 'pdf_text_cache.sqlite3'
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+USE_CONTENT_HASH = True
+LAST_USED_RESOLUTION = 3600  # Seconds; eviction only needs a rough order
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    page_count INTEGER,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS paths (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE
+);
+CREATE TABLE IF NOT EXISTS pages (
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    page_num INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (document_id, page_num)
+);
+CREATE TABLE IF NOT EXISTS fields (
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (document_id, name)
+);
+CREATE INDEX IF NOT EXISTS paths_document ON paths(document_id);
+'''
+
+
+def get_cache_path():
+    return os.path.join(get_user_cache_dir(), CACHE_DB)
+
+
+def _setup(connection):
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute('PRAGMA foreign_keys=ON')
+    connection.executescript(SCHEMA)
+
+
+_database = LocalStore.Database(get_cache_path, _setup)
+_connection = _database.connection
+
+
+def hash_file(filename, chunk_size=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _document_id(filename):
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    connection = _connection()
+    row = connection.execute('SELECT paths.size, paths.mtime_ns, paths.document_id, documents.last_used FROM paths '
+                             'JOIN documents ON documents.id = paths.document_id WHERE path = ?',
+                             (filename,)).fetchone()
+    if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+        document_id = row[2]
+        if time.time() - row[3] > LAST_USED_RESOLUTION:  # A hit otherwise costs no write at all
+            connection.execute('UPDATE documents SET last_used = ? WHERE id = ?', (time.time(), document_id))
+            connection.commit()
+        return document_id
+
+    if USE_CONTENT_HASH:
+        key = f'sha1:{hash_file(filename)}:{stat.st_size}'
+    else:
+        key = f'stat:{filename}:{stat.st_size}:{stat.st_mtime_ns}'
+    connection.execute('INSERT OR IGNORE INTO documents (key, last_used) VALUES (?, ?)', (key, time.time()))
+    connection.execute('UPDATE documents SET last_used = ? WHERE key = ?', (time.time(), key))
+    document_id = connection.execute('SELECT id FROM documents WHERE key = ?', (key,)).fetchone()[0]
+    connection.execute('INSERT OR REPLACE INTO paths (path, size, mtime_ns, document_id) VALUES (?, ?, ?, ?)',
+                       (filename, stat.st_size, stat.st_mtime_ns, document_id))
+    connection.commit()
+    return document_id
+
+
+def _add_bytes(connection, document_id, size):
+    connection.execute('UPDATE documents SET bytes = bytes + ? WHERE id = ?', (size, document_id))
+
+
+def iter_page_texts(filename, max_pages=None):
+    """Yield the extracted text of each page, parsing the PDF only for pages that aren't cached yet"""
+    document_id = _document_id(filename)
+    connection = _connection()
+    page_count = connection.execute('SELECT page_count FROM documents WHERE id = ?', (document_id,)).fetchone()[0]
+    cached = dict(connection.execute('SELECT page_num, text FROM pages WHERE document_id = ?', (document_id,)))
+
+    reader = None
+    file = None
+    added = False
+    try:
+        page_num = 0
+        while (page_count is None or page_num < page_count) and (max_pages is None or page_num < max_pages):
+            if page_num not in cached:
+                if reader is None:
+                    import pypdf  # Only once a page actually has to be parsed
+
+                    file = open(filename, 'rb')
+                    Instrumentation.count_file(filename)
+                    reader = pypdf.PdfReader(file)
+                    if page_count is None:
+                        page_count = len(reader.pages)
+                        connection.execute('UPDATE documents SET page_count = ? WHERE id = ?',
+                                           (page_count, document_id))
+                        connection.commit()
+                        if page_num >= page_count:
+                            break
+                with Instrumentation.span("extract", file=os.path.basename(filename), page=page_num):
+                    text = reader.pages[page_num].extract_text()
+                connection.execute('INSERT OR REPLACE INTO pages (document_id, page_num, text) VALUES (?, ?, ?)',
+                                   (document_id, page_num, text))
+                _add_bytes(connection, document_id, len(text))
+                connection.commit()
+                cached[page_num] = text
+                added = True
+            yield cached[page_num]
+            page_num += 1
+    finally:
+        if file:
+            file.close()
+        if added:
+            evict()
+
+
+def cached_field(filename, name, compute):
+    """Return the parsed field `name` for the file, calling compute() and storing its result on a miss"""
+    document_id = _document_id(filename)
+    connection = _connection()
+    row = connection.execute('SELECT value FROM fields WHERE document_id = ? AND name = ?',
+                             (document_id, name)).fetchone()
+    if row:
+        return json.loads(row[0])
+
+    value = compute()
+    encoded = json.dumps(value)
+    connection.execute('INSERT OR REPLACE INTO fields (document_id, name, value) VALUES (?, ?, ?)',
+                       (document_id, name, encoded))
+    _add_bytes(connection, document_id, len(encoded))
+    connection.commit()
+    return value
+
+
+def invalidate(filename=None):
+    """Forget the cached text of one file, or of every file when no filename is given"""
+    connection = _connection()
+    if filename is None:
+        connection.execute('DELETE FROM documents')
+    else:
+        row = connection.execute('SELECT document_id FROM paths WHERE path = ?',
+                                 (os.path.abspath(filename),)).fetchone()
+        if row:
+            connection.execute('DELETE FROM documents WHERE id = ?', (row[0],))
+    connection.commit()
+
+
+def evict(max_bytes=None):
+    # Drop the least recently used documents until the cache is back under 90% of its budget
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+    connection = _connection()
+    total = connection.execute('SELECT COALESCE(SUM(bytes), 0) FROM documents').fetchone()[0]
+    if total <= max_bytes:
+        return 0
+
+    evicted = 0
+    target = max_bytes * 0.9
+    for document_id, size in connection.execute('SELECT id, bytes FROM documents ORDER BY last_used').fetchall():
+        if total <= target:
+            break
+        connection.execute('DELETE FROM documents WHERE id = ?', (document_id,))
+        total -= size
+        evicted += 1
+    connection.commit()
+    return evicted
@@ -0,0 +1,161 @@
+"""
+Journal of a pipeline run, so a crashed or cancelled run can pick up where it stopped.
+
+The journal is a JSON-lines file per Work Folder in the user data folder.
+Stages append a "done" line for every item (order folder, file) they
+finish, and skip items that are already done when the run is started
+again. Destructive steps (deleting merged photos, deleting originals after
+compression, moves across drives) are written as an "intent" before they
+start and a "commit" after they end. recover() rolls forward any intent
+left open by a crash, e.g. deleting the rest of a folder's photos once its
+merged PDF was written, so a rerun never merges a folder from half of its
+photos. A finished run removes its stages from the journal.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from CacheHandling import get_user_data_dir
+from FileTransfer import PART_SUFFIX
+
+JOURNAL_FOLDER = 'journals'
+
+
+def journal_path(folder):
+    key = hashlib.sha1(os.path.normcase(os.path.abspath(folder)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(get_user_data_dir(), JOURNAL_FOLDER, key + '.jsonl')
+
+
+class RunJournal:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.completed = {}  # stage -> {item: info}
+        self.pending = {}  # intent id -> intent record
+        self._next_id = 1
+        self._load()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    @classmethod
+    def for_folder(cls, folder):
+        return cls(journal_path(folder))
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by the crash
+            op = record.get("op")
+            if op == "done":
+                self.completed.setdefault(record["stage"], {})[record["item"]] = record.get("info") or {}
+            elif op == "intent":
+                self.pending[record["id"]] = record
+                self._next_id = max(self._next_id, record["id"] + 1)
+            elif op == "commit":
+                self.pending.pop(record["id"], None)
+
+    def _append(self, record, durable=False):
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        if durable:
+            os.fsync(self._file.fileno())
+
+    def has_progress(self):
+        return bool(self.pending) or any(self.completed.values())
+
+    def is_done(self, stage, item):
+        return item in self.completed.get(stage, ())
+
+    def mark_done(self, stage, item, **info):
+        with self._lock:
+            self.completed.setdefault(stage, {})[item] = info
+            self._append({"op": "done", "stage": stage, "item": item, "info": info, "time": round(time.time(), 3)})
+
+    def intend(self, stage, action, paths):
+        # Written through to disk before the operation starts, so a crash can never hide it
+        with self._lock:
+            intent_id = self._next_id
+            self._next_id += 1
+            record = {"op": "intent", "id": intent_id, "stage": stage, "action": action, "paths": list(paths),
+                      "time": round(time.time(), 3)}
+            if action == "move":
+                # A file already at the destination wasn't written by this run, so recovery must leave it alone
+                record["destination_existed"] = os.path.exists(record["paths"][1])
+            self.pending[intent_id] = record
+            self._append(record, durable=True)
+        return intent_id
+
+    def commit(self, intent_id):
+        with self._lock:
+            self.pending.pop(intent_id, None)
+            self._append({"op": "commit", "id": intent_id})
+
+    @contextmanager
+    def operation(self, stage, action, paths):
+        """Journal a destructive operation; one that raises stays pending and is finished by recover()"""
+        intent_id = self.intend(stage, action, paths)
+        yield
+        self.commit(intent_id)
+
+    def recover(self):
+        """Finish the operations a crashed run left open and return them"""
+        recovered = []
+        for intent_id, record in sorted(self.pending.items()):
+            roll_forward(record)
+            self.commit(intent_id)
+            recovered.append(record)
+        return recovered
+
+    def finish(self, stages=None):
+        """Forget the completed items of the given stages (all when None) once they ran to the end"""
+        with self._lock:
+            for stage in list(self.completed) if stages is None else stages:
+                self.completed.pop(stage, None)
+            records = [{"op": "done", "stage": stage, "item": item, "info": info}
+                       for stage, items in self.completed.items() for item, info in items.items()]
+            records += list(self.pending.values())
+            self._file.close()
+            if records:
+                temp_path = self.path + '.tmp'
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.writelines(json.dumps(record) + '\n' for record in records)
+                os.replace(temp_path, self.path)
+            elif os.path.exists(self.path):
+                os.remove(self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            if not self.has_progress() and os.path.exists(self.path) and os.path.getsize(self.path) == 0:
+                os.remove(self.path)
+
+
+def roll_forward(record):
+    action, paths = record["action"], record["paths"]
+    if action == "delete":
+        # Only journaled once the output holding these files was written, so deleting the rest is safe
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    elif action == "move":
+        source, destination = paths
+        if os.path.exists(destination + PART_SUFFIX):
+            os.remove(destination + PART_SUFFIX)  # A copy cut short before it was verified and renamed into place
+        # Journals written before destinations were recorded are treated as if the file was already there
+        if os.path.exists(source) and os.path.exists(destination) and not record.get("destination_existed", True):
+            if os.path.getsize(source) == os.path.getsize(destination):
+                os.remove(source)  # The copy finished but the source wasn't deleted yet
+            else:
+                os.remove(destination)  # A partial copy, the stage moves the file again
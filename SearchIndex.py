@@ -0,0 +1,184 @@
+"""
+Full-text search over every work order that went through the Move Folder.
+
+The index stage stores the fields of each merged work order (work order #,
+location, description, date, time in and out) and the text of all of its
+pages in a SQLite database in the user data folder, with an FTS5 table over
+them. Like the work hours store it only reads files that are new or changed
+since the last update, and drops the rows of files that are gone, so it can
+run at the end of every pipeline run. search() answers from the index alone,
+in milliseconds even for tens of thousands of orders, without opening a PDF.
+
+SQLite builds without FTS5 get a plain table instead, searched with LIKE.
+"""
+
+import os
+import re
+import sqlite3
+import time
+
+import Instrumentation
+import LocalStore
+import PdfTextCache
+from CacheHandling import get_user_data_dir
+from FileInfoFill import WORK_ORDER_NUMBER_PATTERN, get_pdf_info, get_work_hours_record
+
+INDEX_DB = 'search_index.sqlite3'
+SEARCH_COLUMNS = ["path", "work_order", "location", "description", "date", "time_in", "time_out"]
+TEXT_COLUMNS = ["work_order", "location", "description", "hours", "body"]
+SEARCH_LIMIT = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    work_order TEXT,
+    location TEXT,
+    description TEXT,
+    date TEXT,
+    time_in TEXT,
+    time_out TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_folder ON orders(folder);
+'''
+FTS_SCHEMA = f"CREATE VIRTUAL TABLE IF NOT EXISTS orders_text USING fts5({', '.join(TEXT_COLUMNS)})"
+PLAIN_SCHEMA = f"CREATE TABLE IF NOT EXISTS orders_text (rowid INTEGER PRIMARY KEY, {', '.join(TEXT_COLUMNS)})"
+
+
+def get_index_path():
+    return os.path.join(get_user_data_dir(), INDEX_DB)
+
+
+def _setup(connection):
+    connection.executescript(SCHEMA)
+    try:
+        connection.execute(FTS_SCHEMA)
+    except sqlite3.OperationalError:
+        connection.execute(PLAIN_SCHEMA)  # No FTS5 in this SQLite
+
+
+_database = LocalStore.Database(get_index_path, _setup)
+_connection = _database.connection
+
+
+def has_fts5(connection=None):
+    row = (connection or _connection()).execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'orders_text'").fetchone()
+    return bool(row) and 'fts5' in row[0].lower()
+
+
+def _folder_key(folder):
+    return os.path.normcase(os.path.abspath(folder))
+
+
+def parse_order(path):
+    """The searchable fields and full text of one work order PDF"""
+    body = "\n".join(PdfTextCache.iter_page_texts(path))
+    match = WORK_ORDER_NUMBER_PATTERN.search(body)
+    if match:
+        work_order = match.group(1)
+    else:
+        match = re.match(r'\d+', os.path.basename(path))
+        work_order = match.group() if match else ""
+    try:
+        location, description = get_pdf_info(path)
+    except IndexError:
+        location, description = "", ""  # Not laid out like a work order download, the text still gets indexed
+    hours = get_work_hours_record(path) or {}
+    return {"work_order": work_order, "location": location, "description": description,
+            "date": hours.get("date", ""), "time_in": hours.get("time_in", ""), "time_out": hours.get("time_out", ""),
+            "hours": " ".join(hours.get("hours") or []), "body": body}
+
+
+def read_order(path):
+    try:
+        with Instrumentation.span("parse-order", file=os.path.basename(path)):
+            record = parse_order(path)
+        Instrumentation.count("files_processed")
+        return path, record, None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def _delete(connection, ids):
+    connection.executemany('DELETE FROM orders_text WHERE rowid = ?', [(row_id,) for row_id in ids])
+    connection.executemany('DELETE FROM orders WHERE id = ?', [(row_id,) for row_id in ids])
+
+
+@Instrumentation.traced("index", is_stage=True)
+def update_folder(folder, workers=None, progress=None):
+    """Index the PDFs of the folder that changed since the last update"""
+    folder_key = _folder_key(folder)
+    connection = _connection()
+    known = {path: (row_id, size, mtime_ns) for row_id, path, size, mtime_ns in
+             connection.execute('SELECT id, path, size, mtime_ns FROM orders WHERE folder = ?', (folder_key,))}
+
+    current = {}
+    for entry in os.scandir(folder):
+        if entry.is_file() and entry.name.lower().endswith('.pdf'):
+            stat = entry.stat()
+            current[os.path.abspath(entry.path)] = (entry.name, stat.st_size, stat.st_mtime_ns)
+
+    removed = [path for path in known if path not in current]
+    changed = [path for path, (name, size, mtime_ns) in current.items()
+               if path not in known or known[path][1:] != (size, mtime_ns)]
+    _delete(connection, [known[path][0] for path in removed])
+
+    errors = []
+    try:
+        with LocalStore.read_all(read_order, changed, workers) as results:
+            for done, (path, record, error) in enumerate(results, start=1):
+                name, size, mtime_ns = current[path]
+                if error:
+                    errors.append({"file": name, "error": error})
+                    # Stored without text anyway, so it isn't read again until it changes
+                    record = {column: "" for column in TEXT_COLUMNS}
+                if path in known:
+                    _delete(connection, [known[path][0]])
+                row_id = connection.execute(
+                    'INSERT INTO orders (path, folder, filename, size, mtime_ns, work_order, location, description, '
+                    'date, time_in, time_out, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (path, folder_key, name, size, mtime_ns, record["work_order"], record["location"],
+                     record["description"], record.get("date", ""), record.get("time_in", ""),
+                     record.get("time_out", ""), time.time())).lastrowid
+                connection.execute(
+                    f'INSERT INTO orders_text (rowid, {", ".join(TEXT_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?)',
+                    [row_id] + [record[column] for column in TEXT_COLUMNS])
+                if progress:
+                    progress(done, len(changed), name)
+    finally:
+        # Committed on a cancel too: the orders indexed so far stay, the next update does the rest
+        connection.commit()
+
+    return {"indexed": len(changed), "unchanged": len(current) - len(changed), "removed": len(removed),
+            "errors": errors}
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query)
+
+
+def search(query, limit=SEARCH_LIMIT):
+    """Rows of SEARCH_COLUMNS for the orders matching every word of the query (as a prefix), best matches first"""
+    terms = search_terms(query)
+    if not terms:
+        return []
+    connection = _connection()
+    columns = ", ".join(f"orders.{column}" for column in SEARCH_COLUMNS)
+    if has_fts5(connection):
+        match = " ".join('"' + term + '"*' for term in terms)
+        rows = connection.execute(
+            f'SELECT {columns} FROM orders_text JOIN orders ON orders.id = orders_text.rowid '
+            f'WHERE orders_text MATCH ? ORDER BY bm25(orders_text), orders.mtime_ns DESC LIMIT ?', (match, limit))
+    else:
+        text = " || ' ' || ".join(f"orders_text.{column}" for column in TEXT_COLUMNS)
+        conditions = " AND ".join(f"({text}) LIKE ?" for term in terms)
+        rows = connection.execute(
+            f'SELECT {columns} FROM orders_text JOIN orders ON orders.id = orders_text.rowid '
+            f'WHERE {conditions} ORDER BY orders.mtime_ns DESC LIMIT ?', [f"%{term}%" for term in terms] + [limit])
+    return [list(row) for row in rows]
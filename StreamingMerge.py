@@ -0,0 +1,182 @@
+"""
+Merging a job folder one document at a time, for folders too big to merge in memory.
+
+PdfWriter.append keeps every page of the merged work order in memory until
+write(), so a folder with a few hundred photos costs gigabytes. StreamingMerge
+writes the objects of each appended document to the output file as soon as
+it's read: only the document being appended is held (the filled form, or one
+converted photo). The page tree, the form fields and the catalog are written
+by close(), together with the cross-reference table.
+
+Only pages and the form fields are carried over; outlines, named destinations
+and document metadata of the inputs are not, which the work order forms and
+photo pages don't have.
+"""
+
+import io
+import os
+
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+
+CATALOG, PAGES = 1, 2  # Object numbers reserved for the objects close() writes
+
+
+class StreamingMerge:
+    def __init__(self, path):
+        # Written under a temporary name and renamed by close(), so a crash never leaves half a merged file
+        self.path = path
+        self._temp_path = path + '.tmp'
+        self._file = open(self._temp_path, 'wb')
+        self._file.write(b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n')
+        self._offsets = {}
+        self._next_number = PAGES + 1
+        self._kids = []
+        self._fields = []
+        # The other /AcroForm entries of all documents, serialized. Later documents win, so the filled template
+        # appended after the order supplies /DA, and /DR is merged font by font
+        self._form_entries = None
+        self._resources = {}
+        self._need_appearances = False
+        self.pages = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type:
+            self._file.close()
+            os.remove(self._temp_path)
+        else:
+            self.close()
+        return False
+
+    def append(self, source):
+        """Append every page of source (a path or a file object) and its form fields"""
+        reader = PdfReader(source)
+        numbers = {}
+        queue = []
+
+        def number(reference):
+            key = (reference.idnum, reference.generation)
+            if key not in numbers:
+                numbers[key] = self._next_number
+                self._next_number += 1
+                queue.append(reference)
+            return numbers[key]
+
+        for page in reader.pages:
+            self._kids.append(number(page.indirect_reference))
+            self.pages += 1
+            self._drain(queue, number)
+
+        acroform = reader.trailer["/Root"].get_object().get("/AcroForm")
+        if acroform is not None:
+            acroform = acroform.get_object()
+            self._fields += [number(field) for field in acroform.get("/Fields", [])
+                             if isinstance(field, IndirectObject)]
+            if self._form_entries is None:
+                self._form_entries = {}
+            for key, value in acroform.items():
+                value = value.get_object() if isinstance(value, IndirectObject) else value
+                if key == "/Fields":
+                    continue
+                if key == "/NeedAppearances":
+                    # pdfrw-filled values are only drawn when the viewer is told to, so any document asking keeps it
+                    self._need_appearances = self._need_appearances or value == True
+                elif key == "/DR" and isinstance(value, DictionaryObject):
+                    for category, resources in value.items():
+                        resources = resources.get_object()
+                        if isinstance(resources, DictionaryObject):
+                            merged = self._resources.setdefault(category, {})
+                            for name, resource in resources.items():
+                                merged[name] = self._to_bytes(resource, number)
+                else:
+                    self._form_entries[key] = self._to_bytes(value, number)
+            self._drain(queue, number)
+
+    def _drain(self, queue, number):
+        while queue:
+            reference = queue.pop()
+            self._begin(number(reference))
+            self._serialize(reference.get_object(), self._file, number)
+            self._file.write(b'\nendobj\n')
+
+    def _to_bytes(self, obj, number):
+        out = io.BytesIO()
+        self._serialize(obj, out, number)
+        return out.getvalue()
+
+    def _dictionary(self, entries):
+        items = b''.join(self._to_bytes(key, None) + b' ' + value + b'\n' for key, value in entries.items())
+        return b'<<' + items + b'>>'
+
+    def _begin(self, object_number):
+        self._offsets[object_number] = self._file.tell()
+        self._file.write(b'%d 0 obj\n' % object_number)
+
+    def _serialize(self, obj, out, number):
+        if obj is None:
+            out.write(b'null')
+        elif isinstance(obj, IndirectObject):
+            out.write(b'%d 0 R' % number(obj))
+        elif isinstance(obj, DictionaryObject):
+            is_page = obj.get("/Type") == "/Page"
+            data = obj._data if isinstance(obj, StreamObject) else None  # Still encoded as in the source file
+            out.write(b'<<')
+            for key, value in obj.items():
+                if key == "/Length" and data is not None:
+                    continue
+                key.write_to_stream(out)
+                out.write(b' ')
+                if is_page and key == "/Parent":
+                    out.write(b'%d 0 R' % PAGES)  # Pages are re-parented to the merged page tree
+                else:
+                    self._serialize(value, out, number)
+                out.write(b'\n')
+            if data is not None:
+                out.write(b'/Length %d>>\nstream\n' % len(data))
+                out.write(data)
+                out.write(b'\nendstream')
+            else:
+                out.write(b'>>')
+        elif isinstance(obj, ArrayObject):
+            out.write(b'[')
+            for item in obj:
+                self._serialize(item, out, number)
+                out.write(b' ')
+            out.write(b']')
+        else:
+            obj.write_to_stream(out)
+
+    def close(self):
+        out = self._file
+        self._begin(PAGES)
+        kids = b' '.join(b'%d 0 R' % kid for kid in self._kids)
+        out.write(b'<</Type /Pages /Kids [%s] /Count %d>>\nendobj\n' % (kids, len(self._kids)))
+        catalog = b'<</Type /Catalog /Pages %d 0 R' % PAGES
+        if self._form_entries is not None:
+            acroform_number = self._next_number
+            self._next_number += 1
+            self._begin(acroform_number)
+            entries = dict(self._form_entries)
+            if self._resources:
+                entries[NameObject("/DR")] = self._dictionary(
+                    {category: self._dictionary(names) for category, names in self._resources.items()})
+            if self._need_appearances:
+                entries[NameObject("/NeedAppearances")] = b'true'
+            entries[NameObject("/Fields")] = b'[%s]' % b' '.join(b'%d 0 R' % field for field in self._fields)
+            out.write(self._dictionary(entries) + b'\nendobj\n')
+            catalog += b' /AcroForm %d 0 R' % acroform_number
+        self._begin(CATALOG)
+        out.write(catalog + b'>>\nendobj\n')
+
+        xref = out.tell()
+        out.write(b'xref\n0 %d\n0000000000 65535 f \n' % self._next_number)
+        for object_number in range(1, self._next_number):
+            out.write(b'%010d 00000 n \n' % self._offsets[object_number])
+        out.write(b'trailer\n<</Size %d /Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n'
+                  % (self._next_number, CATALOG, xref))
+        out.close()
+        os.replace(self._temp_path, self.path)
+
@@ -1,15 +1,52 @@
+import time
+
+STARTUP = time.perf_counter()  # Taken before the imports below, which the startup times include
+
+import json
+import multiprocessing
 import os
 
 import FileArrangement
+import Instrumentation
+import PdfTextCache
+import SearchIndex
 import sys
+from PySide6.QtCore import Qt, QTimer
 from PySide6.QtGui import QFont, QIcon
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QVBoxLayout, QLabel, QStatusBar,
     QGridLayout, QToolBar, QStyleFactory, QComboBox, QPushButton,
-    QLineEdit, QWidget, QFileDialog, QMessageBox, QTableWidget, QAbstractItemView, QTableWidgetItem, QHeaderView
+    QLineEdit, QWidget, QFileDialog, QMessageBox, QTableView, QAbstractItemView, QHeaderView, QProgressBar
 )
 from CacheHandling import *
-from FileInfoFill import get_work_hours
+from DirectorySnapshot import DirectorySnapshot
+import WorkHoursStore
+from FileTableModel import DEFAULT_HEADERS, FileFilterProxyModel, FileTableModel
+from FolderWatcher import FolderWatcher, list_folders
+from JobEngine import Job, JobEngine
+from RunJournal import RunJournal
+
+PROFILED_STAGES = ["plan-renames", "rename", "create-folders", "fill-forms", "backup-images", "merge",
+                   "restore-images", "move-merged", "compress", "remove-pre-and-suf", "work-hours", "index"]
+STARTUP_REPORT_ENV = 'WOM_STARTUP_REPORT'  # Append startup times as JSON to this file and quit once the window shows
+STARTUP_TIMES = {}  # phase -> seconds since STARTUP
+SEARCH_HEADERS = ["File", "Work Order #", "Location", "Description", "Date", "Time in", "Time Out"]
+SEARCH_DELAY_MS = 150  # Wait for a pause in typing before searching
+# Memory the merge may hold in converted photos, in MB; with a limit folders are streamed to disk page by page
+MERGE_MEMORY_BUDGETS = {"No memory limit": None, "512 MB merge": 512, "1 GB merge": 1024, "2 GB merge": 2048}
+
+
+def mark_startup(phase):
+    STARTUP_TIMES[phase] = round(time.perf_counter() - STARTUP, 4)
+
+
+def write_startup_report(path):
+    report = {"seconds": dict(STARTUP_TIMES), "frozen": bool(getattr(sys, "frozen", False)), "time": time.time()}
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(report) + "\n")
+
+
+mark_startup("imports")
 
 
 class MainWindow(QMainWindow):
@@ -102,20 +139,27 @@ class MainWindow(QMainWindow):
         grid_layout.addWidget(self.export_clear_button, len(options) + 1, 3)
 
         # Content display
-        # Replace self.text_edit with a QTableWidget
-        self.table_widget = QTableWidget()
-        self.table_widget.setColumnCount(3)  # One column to display the file names
-        self.table_widget.setHorizontalHeaderLabels(["Files in directory", "Time in", "Time Out"])
-        self.table_widget.setSelectionMode(QAbstractItemView.SingleSelection)  # Allow selecting a single item
-
-        # Set resize mode for all columns to Stretch
-        for column in range(self.table_widget.columnCount()):
-            self.table_widget.horizontalHeader().setSectionResizeMode(column, QHeaderView.Stretch)
-
-        # Connect the itemDoubleClicked signal to the custom slot open_file
-        self.table_widget.itemDoubleClicked.connect(self.open_file)
-
-        grid_layout.addWidget(self.table_widget, 0, 4, len(options) + 2, 1)  # Modify the row span to match the options
+        # The table view reads from a lazily fetched model through a sort/filter proxy
+        self.table_model = FileTableModel(self)
+        self.table_proxy = FileFilterProxyModel(self)
+        self.table_proxy.setSourceModel(self.table_model)
+        self.table_view = QTableView()
+        self.table_view.setModel(self.table_proxy)
+        self.table_view.setSortingEnabled(True)
+        self.table_view.sortByColumn(-1, Qt.AscendingOrder)  # Keep folder order until a header is clicked
+        self.table_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table_view.setSelectionMode(QAbstractItemView.SingleSelection)  # Allow selecting a single item
+        self.table_view.verticalHeader().setVisible(False)
+
+        # First column fits the file names, the time columns share the rest
+        self.table_view.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeToContents)
+        for column in range(1, self.table_model.columnCount()):
+            self.table_view.horizontalHeader().setSectionResizeMode(column, QHeaderView.Stretch)
+
+        # Connect the doubleClicked signal to the custom slot open_file
+        self.table_view.doubleClicked.connect(self.open_file)
+
+        grid_layout.addWidget(self.table_view, 0, 4, len(options) + 2, 1)  # Modify the row span to match the options
 
         main_layout.addLayout(grid_layout)
         main_widget.setLayout(main_layout)
@@ -131,27 +175,192 @@ class MainWindow(QMainWindow):
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
 
+        # Progress of background jobs
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
+        self.status_bar.addPermanentWidget(self.progress_bar)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setToolTip("Stops the running job after the current file and drops queued jobs")
+        self.cancel_button.setVisible(False)
+        self.status_bar.addPermanentWidget(self.cancel_button)
+
+        self.job_engine = JobEngine(self)
+        self.journals = {}  # folder -> RunJournal
+        self.job_engine.queue_changed.connect(self.job_queue_changed)
+        self.cancel_button.clicked.connect(self.job_engine.cancel_all)
+
+        # Files added, removed or renamed in the Work Folder and Move Folder show up without a rescan
+        self.table_mode = "listing"
+        self.folder_watcher = FolderWatcher(self)
+        self.folder_watcher.changed.connect(self.apply_folder_changes)
+
         # Load the last used directory
         last_used_directory = load_last_used_directory()
         if last_used_directory:
             self.path_input.setText(last_used_directory)
-            self.display_content()
 
         # Load the last used export directory
         last_used_export_directory = load_last_used_export_directory()
         if last_used_export_directory:
             self.export_input.setText(last_used_export_directory)
 
+        # The table is filled by show_initial_view once the window is on screen, so a slow share can't hold it up
+        self.initial_view_shown = False
+
         # Add template button
         add_template = QPushButton("Add Template")
         add_template.setToolTip("Adds work order fillable template")
         add_template.clicked.connect(lambda: FileArrangement.copy_paste_fillable_template(last_used_directory))
         self.toolbar.addWidget(add_template)
 
+        # Filter for the file table
+        self.filter_input = QLineEdit()
+        self.filter_input.setPlaceholderText("Filter files...")
+        self.filter_input.setClearButtonEnabled(True)
+        self.filter_input.textChanged.connect(self.filter_table)
+        self.toolbar.addWidget(self.filter_input)
+
+        # Search over every work order indexed from the Move Folder
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search work orders...")
+        self.search_input.setToolTip("Finds work orders by number, location, description, time or any of their text")
+        self.search_input.setClearButtonEnabled(True)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY_MS)
+        self.search_timer.timeout.connect(self.search_work_orders)
+        self.search_input.textChanged.connect(self.search_timer.start)
+        self.toolbar.addWidget(self.search_input)
+
+        # Preview rename button
+        preview_rename = QPushButton("Preview Rename")
+        preview_rename.setToolTip("Shows the new work order file names before renaming")
+        preview_rename.clicked.connect(self.preview_rename)
+        self.toolbar.addWidget(preview_rename)
+
+        # Work hours buttons
+        work_hours = QPushButton("Work Hours")
+        work_hours.setToolTip("Shows time in and time out of the work orders in the Move Folder")
+        work_hours.clicked.connect(self.update_work_hours_in_table)
+        self.toolbar.addWidget(work_hours)
+        export_hours = QPushButton("Export Work Hours")
+        export_hours.setToolTip("Saves work order #, date, time in and time out to CSV or JSON")
+        export_hours.clicked.connect(self.export_work_hours)
+        self.toolbar.addWidget(export_hours)
+
+        # Clear text cache button
+        clear_cache = QPushButton("Clear Text Cache")
+        clear_cache.setToolTip("Forgets text extracted from previously read PDFs")
+        clear_cache.clicked.connect(self.clear_text_cache)
+        self.toolbar.addWidget(clear_cache)
+
+        # Tracing and profiling, preset from WOM_TRACE / WOM_PROFILE
+        self.trace_button = QPushButton("Trace")
+        self.trace_button.setCheckable(True)
+        self.trace_button.setChecked(Instrumentation.is_tracing())
+        self.trace_button.setToolTip("Writes stage and file timings to a JSON-lines trace file")
+        self.trace_button.toggled.connect(self.set_tracing)
+        self.toolbar.addWidget(self.trace_button)
+        self.profile_combo = QComboBox()
+        self.profile_combo.addItems(["No profiling"] + PROFILED_STAGES)
+        self.profile_combo.setToolTip("Runs cProfile over the chosen stage and saves <stage>.prof next to the trace")
+        if Instrumentation.profile_stage() in PROFILED_STAGES:
+            self.profile_combo.setCurrentText(Instrumentation.profile_stage())
+        self.profile_combo.currentIndexChanged.connect(self.set_tracing)
+        self.toolbar.addWidget(self.profile_combo)
+
+        # Memory budget of the merge, for PCs that run out of memory on folders with many photos
+        self.memory_budget_combo = QComboBox()
+        self.memory_budget_combo.addItems(list(MERGE_MEMORY_BUDGETS))
+        self.memory_budget_combo.setToolTip("Limits the memory the merge holds in converted photos; "
+                                            "larger folders are then written to disk page by page")
+        for label, megabytes in MERGE_MEMORY_BUDGETS.items():
+            if megabytes == load_last_used_memory_budget():
+                self.memory_budget_combo.setCurrentText(label)
+        self.memory_budget_combo.currentIndexChanged.connect(self.select_memory_budget)
+        self.toolbar.addWidget(self.memory_budget_combo)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self.initial_view_shown:
+            self.initial_view_shown = True
+            # Runs on the first pass of the event loop after show(), when the window has been painted
+            QTimer.singleShot(0, self.show_initial_view)
+
+    def show_initial_view(self):
+        mark_startup("first_paint")
+        Instrumentation.log("Startup", **STARTUP_TIMES)
+        report_path = os.environ.get(STARTUP_REPORT_ENV)
+        if report_path:
+            write_startup_report(report_path)
+            self.close()
+            return
+
+        # Reopen the table the way it was left, work hours come straight from the store
+        if load_last_used_table_view() == "work_hours" and self.export_input.text():
+            self.update_work_hours_in_table()
+            self.watch_folders_async()
+        elif self.path_input.text():
+            self.display_content_async()
+        else:
+            self.watch_folders_async()
+
+    def preview_rename(self):
+        root_folder_path = self.path_input.text()
+        self.submit_job("Rename preview", [
+            ("Reading work order numbers...",
+             lambda progress: FileArrangement.plan_renames(root_folder_path, progress=progress)),
+        ], on_finished=lambda results: self.show_rename_plan(root_folder_path,
+                                                             results["Reading work order numbers..."]))
+
+    def show_rename_plan(self, root_folder_path, plan):
+        rows = [[entry["file"], FileArrangement.describe_rename(entry), ", ".join(entry.get("conflicts") or [])]
+                for entry in plan]
+        self.table_model.set_rows(rows, folder=root_folder_path,
+                                  headers=["Files in directory", "Rename to", "Differs from"])
+        self.table_mode = "preview"
+
+        rename_count = sum(1 for entry in plan if entry["new_name"])
+        duplicate_count = sum(1 for entry in plan if entry.get("duplicate_of"))
+        if not rename_count and not duplicate_count:
+            self.status_bar.showMessage("No PDF files to rename.")
+            return
+        question = f"Rename {rename_count} PDF files as shown?"
+        if duplicate_count:
+            question = (f"Rename {rename_count} PDF files and move {duplicate_count} duplicates to "
+                        f"'{FileArrangement.DUPLICATES_FOLDER}' as shown?")
+        confirmation = QMessageBox.question(self, "Confirm Rename", question, QMessageBox.Yes | QMessageBox.No)
+        if confirmation == QMessageBox.Yes:
+            self.submit_job("Extraction and renaming", [
+                ("Renaming PDF files...",
+                 lambda progress: FileArrangement.apply_rename_plan(root_folder_path, plan, progress=progress)),
+            ], on_finished=lambda results: self.show_work_folder())
+        else:
+            self.show_work_folder()
+
+    def set_tracing(self):
+        trace_path = None
+        if self.trace_button.isChecked():
+            trace_path = Instrumentation.trace_path() or Instrumentation.default_trace_path()
+        profile_stage = self.profile_combo.currentText() if self.profile_combo.currentIndex() > 0 else None
+        Instrumentation.configure(trace_path, profile_stage)
+        if trace_path:
+            self.status_bar.showMessage(f"Tracing to {trace_path}")
+        elif profile_stage:
+            self.status_bar.showMessage(f"Profiling {profile_stage} into {Instrumentation.profile_path(profile_stage)}")
+
+    def clear_text_cache(self):
+        PdfTextCache.invalidate()
+        self.status_bar.showMessage("Cleared PDF text cache.")
+
     def clear_folders(self):
         work_folder = self.path_input.text()
         move_folder = self.export_input.text()
 
+        if self.job_engine.is_busy():
+            self.status_bar.showMessage("Wait for the running job to finish before clearing folders.")
+            return
+
         # Confirmation dialog
         confirmation = QMessageBox.question(
             self, "Confirm Clear Folders",
@@ -167,7 +376,7 @@ class MainWindow(QMainWindow):
             FileArrangement.delete_files_and_folders(move_folder)
 
             # Update status bar message
-            self.display_content()
+            self.show_work_folder()
             self.status_bar.showMessage("Cleared Work Folder and Move Folder.")
 
     def select_font_size(self):
@@ -195,6 +404,13 @@ class MainWindow(QMainWindow):
         for button in self.option_buttons:
             button.setFont(font)
 
+    def select_memory_budget(self):
+        save_last_used_memory_budget(MERGE_MEMORY_BUDGETS[self.memory_budget_combo.currentText()])
+
+    def merge_memory_budget(self):
+        megabytes = MERGE_MEMORY_BUDGETS[self.memory_budget_combo.currentText()]
+        return megabytes * 2 ** 20 if megabytes else None
+
     def select_theme(self):
         selected_theme = self.sender().currentText()
         QApplication.setStyle(QStyleFactory.create(selected_theme))
@@ -207,22 +423,90 @@ class MainWindow(QMainWindow):
             selected_folder = dialog.selectedUrls()[0].toLocalFile()
             self.path_input.setText(selected_folder)
             self.display_content()
+            self.update_watched_folders()
             save_last_used_directory(selected_folder)
 
     def display_content(self):
         root_folder_path = self.path_input.text()
-        content = FileArrangement.display_content_in_path(root_folder_path).splitlines()
+        self.show_listing(root_folder_path, FileArrangement.list_content_in_path(root_folder_path))
 
-        # Clear existing table content
-        self.table_widget.clearContents()
-        self.table_widget.setRowCount(len(content))
+    def display_content_async(self):
+        # Listing a folder on a network share can take seconds, so at startup it runs as a job. The same listings
+        # of the Work Folder and Move Folder are what the folder watcher compares later changes against.
+        root_folder_path = self.path_input.text()
+        folders = self.watched_folders()
+        self.submit_job("Listing Work Folder", [
+            ("Listing Work Folder...", lambda progress: list_folders(folders)),
+        ], on_finished=lambda results: self.work_folder_listed(root_folder_path, results["Listing Work Folder..."]))
+
+    def work_folder_listed(self, root_folder_path, listings):
+        content = listings.get(os.path.normpath(root_folder_path))
+        if content is None:
+            self.status_bar.showMessage(f"Could not list the Work Folder {root_folder_path}.")
+        # Unless something else was opened in the meantime
+        elif self.table_mode == "listing" and root_folder_path == self.path_input.text():
+            self.show_listing(root_folder_path, list(content))
+        self.update_watched_folders(listings)
+
+    def watch_folders_async(self):
+        folders = self.watched_folders()
+        self.submit_job("Listing watched folders", [
+            ("Listing watched folders...", lambda progress: list_folders(folders)),
+        ], on_finished=lambda results: self.update_watched_folders(results["Listing watched folders..."]))
+
+    def show_listing(self, root_folder_path, content):
+        self.table_model.set_rows([[filename] for filename in content], folder=root_folder_path,
+                                  headers=DEFAULT_HEADERS)
+        self.table_mode = "listing"
+        save_last_used_table_view("listing")
+
+    def show_work_folder(self):
+        # While the table already lists the Work Folder the watcher keeps it current, so only pick up pending changes
+        if self.table_mode == "listing" and self.table_model.folder == self.path_input.text():
+            self.folder_watcher.refresh(self.path_input.text())
+        else:
+            self.display_content()
 
-        # Populate the table with the file names
-        for row, filename in enumerate(content):
-            item = QTableWidgetItem(filename)
-            self.table_widget.setItem(row, 0, item)
-        # Auto-resize the first column to fit the content
-        self.table_widget.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeToContents)
+    def watched_folders(self):
+        return [self.path_input.text(), self.export_input.text()]
+
+    def update_watched_folders(self, listings=None):
+        self.folder_watcher.set_folders(self.watched_folders(), listings)
+
+    def apply_folder_changes(self, folder, added, removed, renamed):
+        if not self.table_model.folder or os.path.normpath(self.table_model.folder) != folder:
+            return
+        if self.table_mode == "listing":
+            self.table_model.remove_names(removed)
+            for old_name, new_name in renamed:
+                self.table_model.rename(old_name, new_name)
+            self.table_model.add_rows([[name] for name in added])
+        elif self.table_mode == "work_hours":
+            self.table_model.remove_names(removed)
+            for old_name, new_name in renamed:
+                self.table_model.rename(old_name, new_name)
+            if any(name.lower().endswith('.pdf') for name in added) and not self.job_engine.is_busy():
+                self.update_work_hours_in_table()
+
+    def filter_table(self, text):
+        # The proxy can only filter rows the model has handed out, so load them all while a filter is typed
+        if text:
+            self.table_model.fetch_all()
+        self.table_proxy.setFilterFixedString(text)
+
+    def search_work_orders(self):
+        query = self.search_input.text()
+        if not SearchIndex.search_terms(query):
+            if self.table_mode == "search":
+                self.show_work_folder()
+            return
+        start = time.perf_counter()
+        rows = SearchIndex.search(query)
+        # Results come from many folders, so the first column holds the whole path and open_file uses it as is
+        self.table_model.set_rows(rows, folder="", headers=SEARCH_HEADERS)
+        self.table_mode = "search"
+        self.status_bar.showMessage(
+            f"{len(rows)} work orders found in {(time.perf_counter() - start) * 1000:.0f}ms.")
 
     def open_export_folder_dialog(self):
         dialog = QFileDialog()
@@ -230,95 +514,224 @@ class MainWindow(QMainWindow):
         if dialog.exec():
             selected_folder = dialog.selectedUrls()[0].toLocalFile()
             self.export_input.setText(selected_folder)
+            self.update_watched_folders()
             save_last_used_export_directory(selected_folder)
 
     def move_merged_files(self):
-        FileArrangement.move_merged_pdfs(self.path_input.text(), self.export_input.text())
-        self.status_bar.showMessage("Moved merge files completed.")
-        FileArrangement.compress_pdf_files(self.export_input.text())
-        self.status_bar.showMessage("File Compression completed.")
-        FileArrangement.remove_pre_and_suf(self.export_input.text())
-
-        # Call get_work_hours function for each merged file
-        self.update_work_hours_in_table()
+        root_folder_path = self.path_input.text()
+        move_folder = self.export_input.text()
+        snapshot = DirectorySnapshot()
+        journal = self.open_journal(root_folder_path)
+        self.submit_job("Move merged files", [
+            ("Moving merged files...",
+             lambda progress: FileArrangement.move_merged_pdfs(root_folder_path, move_folder, progress=progress,
+                                                               snapshot=snapshot, journal=journal)),
+            ("Compressing files...",
+             lambda progress: FileArrangement.compress_pdf_files(move_folder, progress=progress, snapshot=snapshot,
+                                                                 journal=journal)),
+            ("Removing prefixes and suffixes...",
+             lambda progress: FileArrangement.remove_pre_and_suf(move_folder, progress=progress, snapshot=snapshot)),
+            # Read work hours of the new and changed merged files only
+            ("Reading work hours...",
+             lambda progress: WorkHoursStore.update_folder(move_folder, progress=progress)),
+            ("Indexing work orders...",
+             lambda progress: SearchIndex.update_folder(move_folder, progress=progress)),
+        ], on_finished=self.merged_files_moved, journal=journal, journal_stages=["move-merged", "compress"])
+
+    def merged_files_moved(self, results):
+        transfer = results["Moving merged files..."]
+        summary = FileArrangement.summarize_compression(results["Compressing files..."])
+        self.update_table_with_work_hours(results["Reading work hours..."]["rows"])
+        moved = f"Moved {transfer['files']} files"
+        if transfer["copied"] and transfer["mb_per_second"]:
+            moved += f" at {transfer['mb_per_second']:.1f}MB/s"
+        if transfer["failed"]:
+            moved += f", {transfer['failed']} failed to move"
+        self.status_bar.showMessage(
+            f"{moved}. File Compression completed: {summary['compressed']} compressed "
+            f"(saved {summary['saved'] / 1000000:.1f}MB), {summary['skipped'] + summary['kept_original']} left as they "
+            f"were, {summary['failed']} failed.")
 
     def update_work_hours_in_table(self):
         move_folder = self.export_input.text()
-        work_hours_data = []
-
-        for filename in os.listdir(move_folder):
-            if filename.lower().endswith('.pdf'):
-                pdf_file_path = os.path.join(move_folder, filename)
-                work_hours = get_work_hours(pdf_file_path)
-
-                if work_hours:
-                    work_hours_data.append([filename] + work_hours)
-
-        # Update the table with the work hours data
-        self.update_table_with_work_hours(work_hours_data)
+        if not move_folder or not os.path.isdir(move_folder):
+            self.status_bar.showMessage("Choose a Move Folder first.")
+            return
+
+        # Show what is stored right away, then parse only the files that changed since
+        self.update_table_with_work_hours(WorkHoursStore.load_folder(move_folder))
+        self.submit_job("Read work hours", [
+            ("Reading work hours...", lambda progress: WorkHoursStore.update_folder(move_folder, progress=progress)),
+        ], on_finished=self.work_hours_updated)
+
+    def work_hours_updated(self, results):
+        result = results["Reading work hours..."]
+        if self.table_mode == "work_hours":
+            self.update_table_with_work_hours(result["rows"])
+        self.status_bar.showMessage(
+            f"Work hours updated: {result['parsed']} read, {result['unchanged']} unchanged, "
+            f"{len(result['errors'])} failed.")
 
     def update_table_with_work_hours(self, data):
-        # Clear existing table content
-        self.table_widget.clearContents()
-        self.table_widget.setRowCount(len(data))
-
-        # Populate the table with the work hours data
-        for row, row_data in enumerate(data):
-            for col, cell_value in enumerate(row_data):
-                item = QTableWidgetItem(cell_value)
-                self.table_widget.setItem(row, col, item)
-
-        # Resize Time In and Time Out columns to fit the content
-        self.table_widget.resizeColumnToContents(1)
-        self.table_widget.resizeColumnToContents(2)
-
-    def open_file(self, item):
+        self.table_model.set_rows(data, folder=self.export_input.text(), headers=DEFAULT_HEADERS)
+        self.table_mode = "work_hours"
+        save_last_used_table_view("work_hours")
+
+    def export_work_hours(self):
+        output_path, _ = QFileDialog.getSaveFileName(
+            self, "Export Work Hours", "work_hours.csv", "CSV files (*.csv);;JSON files (*.json)")
+        if output_path:
+            count = WorkHoursStore.export_work_hours(output_path)
+            self.status_bar.showMessage(f"Exported {count} work orders to {output_path}.")
+
+    def open_file(self, index):
         # Get the selected row and the first column item (filename)
-        row = item.row()
-        filename_item = self.table_widget.item(row, 0)
-
-        if filename_item:
-            filename = filename_item.text()
-            file_path = os.path.join(self.export_input.text(), filename)
+        row = self.table_proxy.mapToSource(index).row()
+        filename = self.table_model.key(row)
+        file_path = os.path.join(self.table_model.folder, filename)
 
-            # Check if the file exists and open it
-            if os.path.exists(file_path):
-                os.startfile(file_path)  # Windows only, for other platforms use different methods
+        # Check if the file exists and open it
+        if os.path.exists(file_path):
+            os.startfile(file_path)  # Windows only, for other platforms use different methods
 
     def handle_option(self):
         option = self.option_buttons.index(self.sender())
         root_folder_path = self.path_input.text()
+        template = "Fillable Work order template.pdf"
+        snapshot = DirectorySnapshot()  # Listed once per job and shared by its stages
 
         if option == 0:
-            self.status_bar.showMessage("Extracting work order numbers and renaming PDF files...")
             FileArrangement.debug_print("Option 0 selected: Extract work order numbers and rename PDF files")
-            FileArrangement.rename_pdf_files(root_folder_path)
-            self.display_content()
-            self.status_bar.showMessage(f"Extraction and renaming completed.")
+            self.submit_job("Extraction and renaming", [
+                ("Extracting work order numbers and renaming PDF files...",
+                 lambda progress: FileArrangement.rename_pdf_files(root_folder_path, progress=progress,
+                                                                   snapshot=snapshot)),
+            ], on_finished=lambda results: self.show_work_folder())
         elif option == 1:
-            self.status_bar.showMessage("Creating folders for PDF files...")
             FileArrangement.debug_print("Option 1 selected: Create folders for PDF files")
-            created_count = FileArrangement.create_folders_and_move_files(root_folder_path)
-            self.status_bar.showMessage(f"Created {created_count} folders.")
-            self.status_bar.showMessage("Copying PDF Template to each folder...")
-            FileArrangement.copy_pdf_to_subfolders(root_folder_path, "Fillable Work order template.pdf")
-            self.display_content()
-            FileArrangement.fill_pdf_forms(root_folder_path, "Fillable Work order template.pdf")
-            self.status_bar.showMessage("Folder creation completed.")
+            journal = self.open_journal(root_folder_path)
+            self.submit_job("Folder creation", [
+                ("Creating folders for PDF files...",
+                 lambda progress: FileArrangement.create_folders_and_move_files(root_folder_path, progress=progress,
+                                                                                snapshot=snapshot)),
+                ("Filling PDF forms...",
+                 lambda progress: FileArrangement.fill_pdf_forms(root_folder_path, template, progress=progress,
+                                                                 snapshot=snapshot, journal=journal)),
+            ], on_finished=self.folder_creation_finished, journal=journal, journal_stages=["fill-forms"])
         elif option == 2:
             FileArrangement.debug_print("Option 2 selected: Merge files by folder")
-            self.status_bar.showMessage("Creating Job Image Backups...")
-            FileArrangement.create_job_images_folders(root_folder_path)
-            self.status_bar.showMessage("Merging PDFs and Image Files...")
-            FileArrangement.merge_pdfs_and_images(root_folder_path)
-            self.status_bar.showMessage("Deleting converted Image files...")
-            deleted_count = FileArrangement.delete_converted_pdfs(root_folder_path)
-            FileArrangement.move_files_and_delete_folder(root_folder_path)
-            self.status_bar.showMessage(f"Merging completed.")
+            journal = self.open_journal(root_folder_path)
+            memory_budget = self.merge_memory_budget()
+            self.submit_job("Merging", [
+                ("Creating Job Image Backups...",
+                 lambda progress: FileArrangement.create_job_images_folders(root_folder_path, progress=progress,
+                                                                            snapshot=snapshot)),
+                ("Merging PDFs and Image Files...",
+                 lambda progress: FileArrangement.merge_pdfs_and_images(root_folder_path, progress=progress,
+                                                                        snapshot=snapshot, journal=journal,
+                                                                        memory_budget=memory_budget)),
+                ("Restoring Job Images...",
+                 lambda progress: FileArrangement.move_files_and_delete_folder(root_folder_path, progress=progress,
+                                                                               snapshot=snapshot)),
+            ], on_finished=self.merging_finished, journal=journal, journal_stages=["merge"])
+
+    def folder_creation_finished(self, results):
+        self.show_work_folder()
+        failed = [result for result in results["Filling PDF forms..."] if result["error"]]
+        self.status_bar.showMessage(
+            f"Folder creation completed: {results['Creating folders for PDF files...']} folders, "
+            f"{len(failed)} forms failed.")
+        if failed:
+            QMessageBox.warning(self, "Fill PDF forms", "\n".join(
+                f"{result['order']}: {result['error']}" for result in failed))
+
+    def merging_finished(self, results):
+        self.show_work_folder()
+        merge_result = results["Merging PDFs and Image Files..."]
+        timings = [timing for timing in merge_result["images"] if not timing["error"]]
+        failed = len(merge_result["images"]) - len(timings)
+        seconds = sum(timing["seconds"] for timing in timings)
+        average = seconds / len(timings) if timings else 0
+        peak_rss = max(merge_result["peak_rss_mb"].values(), default=None)
+        self.status_bar.showMessage(
+            f"Merging completed: {merge_result['merged']} folders merged, {merge_result['skipped']} unchanged, "
+            f"{len(timings)} images ({average:.2f}s per image), {failed} failed"
+            + (f", peak memory {peak_rss:.0f} MB." if peak_rss is not None else "."))
+
+    def open_journal(self, folder):
+        # One journal per folder for the whole session, so queued jobs of the same folder share its file
+        journal = self.journals.get(folder)
+        if journal is None:
+            journal = self.journals[folder] = RunJournal.for_folder(folder)
+        # Finish what an interrupted job left open, unless a running job's operations are the open ones
+        recovered = [] if self.job_engine.is_busy() else journal.recover()
+        if journal.has_progress() or recovered:
+            self.status_bar.showMessage("Resuming the interrupted run, finished items are skipped.")
+        return journal
+
+    def submit_job(self, name, stages, on_finished=None, journal=None, journal_stages=None):
+        job = Job(name, stages, on_finished)
+        job.journal = journal
+        job.journal_stages = journal_stages
+        job.signals.stage_started.connect(self.job_stage_started)
+        job.signals.progress.connect(self.job_progress)
+        job.signals.finished.connect(self.job_finished)
+        job.signals.failed.connect(self.job_failed)
+        job.signals.cancelled.connect(self.job_cancelled)
+        if self.job_engine.is_busy():
+            self.status_bar.showMessage(f"{name} queued behind {self.job_engine.current_job().name}.")
+        self.job_engine.submit(job)
+
+    def job_queue_changed(self, count):
+        self.progress_bar.setVisible(count > 0)
+        self.cancel_button.setVisible(count > 0)
+        if count == 0:
+            self.progress_bar.reset()
+
+    def job_stage_started(self, stage_name, index, stage_count):
+        self.status_bar.showMessage(stage_name)
+        self.progress_bar.setRange(0, 0)  # Busy indicator until the stage reports its item count
+
+    def job_progress(self, done, total, item):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+        self.progress_bar.setFormat(f"%v/%m {item}" if item else "%v/%m")
+
+    def close_journal(self, job, completed):
+        if job.journal and completed:
+            job.journal.finish(job.journal_stages)
+
+    def job_finished(self, job, results):
+        self.close_journal(job, completed=True)
+        self.status_bar.showMessage(f"{job.name} completed.")
+        if job.on_finished:
+            job.on_finished(results)
+
+    def job_failed(self, job, message, details):
+        self.close_journal(job, completed=False)
+        self.status_bar.showMessage(f"{job.name} failed: {message}")
+        box = QMessageBox(QMessageBox.Warning, job.name, f"{job.name} failed:\n{message}", QMessageBox.Ok, self)
+        box.setDetailedText(details)
+        box.exec()
+        self.show_work_folder()
+
+    def job_cancelled(self, job):
+        self.close_journal(job, completed=False)
+        self.status_bar.showMessage(f"{job.name} cancelled.")
+        self.show_work_folder()
+
+    def closeEvent(self, event):
+        self.job_engine.cancel_all()
+        self.job_engine.wait()
+        for journal in self.journals.values():
+            journal.close()
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Needed by the conversion process pool in the PyInstaller build
     app = QApplication(sys.argv)
     window = MainWindow()
+    mark_startup("window")
     window.show()
     sys.exit(app.exec())
@@ -3,13 +3,16 @@
 
 block_cipher = None
 
+# Startup of the build is measured with: python benchmarks/bench_startup.py --exe "dist/Work Order Program.exe"
+
 
 a = Analysis(
     ['Work Order Program.py'],
     pathex=[],
     binaries=[],
     datas=[('icons/browse.ico', 'icons'), ('icons/clear.ico', 'icons'), ('icons/folder.ico', 'icons'), ('icons/merge.ico', 'icons'), ('icons/move-files.ico', 'icons'), ('icons/rename.ico', 'icons'), ('Fillable Work order template.pdf', '.')],
-    hiddenimports=[],
+    # Imported inside the functions that use them (to keep startup fast) or only by pool workers
+    hiddenimports=['pypdf', 'pdfrw', 'PIL.Image', 'PIL.ImageOps', 'StreamingMerge', 'pdf_compressor'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,137 @@
+"""
+Persistent table of the work hours read from the merged work orders.
+
+Each PDF in the Move Folder is stored with its size and modification time,
+so an update only parses files that are new or changed since the last one,
+spread over a process pool. Rows for files that disappeared are dropped.
+Because the rows survive restarts, the window can show the table straight
+from the store and export months of work hours for payroll without reading
+a single PDF.
+"""
+
+import csv
+import json
+import os
+import re
+import time
+
+import Instrumentation
+import LocalStore
+from CacheHandling import get_user_data_dir
+from FileInfoFill import get_work_hours_record
+
+STORE_DB = 'work_hours.sqlite3'
+EXPORT_COLUMNS = ["work_order", "date", "time_in", "time_out", "file"]
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS work_hours (
+    path TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    work_order TEXT,
+    date TEXT,
+    time_in TEXT,
+    time_out TEXT,
+    hours TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS work_hours_folder ON work_hours(folder);
+'''
+
+
+def get_store_path():
+    return os.path.join(get_user_data_dir(), STORE_DB)
+
+
+_database = LocalStore.Database(get_store_path, lambda connection: connection.executescript(SCHEMA))
+_connection = _database.connection
+
+
+def _folder_key(folder):
+    return os.path.normcase(os.path.abspath(folder))
+
+
+def read_work_hours(path):
+    try:
+        with Instrumentation.span("parse-hours", file=os.path.basename(path)):
+            record = get_work_hours_record(path)
+        Instrumentation.count("files_processed")
+        return path, record, None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+@Instrumentation.traced("work-hours", is_stage=True)
+def update_folder(folder, workers=None, progress=None):
+    """Parse the PDFs of the folder that changed since the last update and return the folder's table rows"""
+    folder_key = _folder_key(folder)
+    connection = _connection()
+    known = {path: (size, mtime_ns) for path, size, mtime_ns in
+             connection.execute('SELECT path, size, mtime_ns FROM work_hours WHERE folder = ?', (folder_key,))}
+
+    current = {}
+    for entry in os.scandir(folder):
+        if entry.is_file() and entry.name.lower().endswith('.pdf'):
+            stat = entry.stat()
+            current[os.path.abspath(entry.path)] = (entry.name, stat.st_size, stat.st_mtime_ns)
+
+    removed = [path for path in known if path not in current]
+    changed = [path for path, (name, size, mtime_ns) in current.items() if known.get(path) != (size, mtime_ns)]
+    connection.executemany('DELETE FROM work_hours WHERE path = ?', [(path,) for path in removed])
+
+    errors = []
+    try:
+        with LocalStore.read_all(read_work_hours, changed, workers) as results:
+            for done, (path, record, error) in enumerate(results, start=1):
+                name, size, mtime_ns = current[path]
+                if error:
+                    errors.append({"file": name, "error": error})
+                record = record or {}
+                match = re.match(r'\d+', name)
+                connection.execute(
+                    'INSERT OR REPLACE INTO work_hours (path, folder, filename, size, mtime_ns, work_order, date, '
+                    'time_in, time_out, hours, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (path, folder_key, name, size, mtime_ns, match.group() if match else os.path.splitext(name)[0],
+                     record.get("date"), record.get("time_in"), record.get("time_out"),
+                     json.dumps(record["hours"]) if record.get("hours") else None, time.time()))
+                if progress:
+                    progress(done, len(changed), name)
+    finally:
+        # Keep whatever was read before a cancel, the next update picks up the rest
+        connection.commit()
+
+    return {"rows": load_folder(folder), "parsed": len(changed), "unchanged": len(current) - len(changed),
+            "removed": len(removed), "errors": errors}
+
+
+def load_folder(folder):
+    """Table rows ([file name] + work hours) of the folder as last stored, without touching the PDFs"""
+    rows = _connection().execute('SELECT filename, hours FROM work_hours WHERE folder = ? AND hours IS NOT NULL '
+                                 'ORDER BY filename', (_folder_key(folder),))
+    return [[filename] + json.loads(hours) for filename, hours in rows]
+
+
+def load_records(folder=None):
+    query = 'SELECT work_order, date, time_in, time_out, filename FROM work_hours WHERE hours IS NOT NULL'
+    parameters = ()
+    if folder:
+        query += ' AND folder = ?'
+        parameters = (_folder_key(folder),)
+    rows = _connection().execute(query + ' ORDER BY work_order, filename', parameters)
+    return [dict(zip(EXPORT_COLUMNS, row)) for row in rows]
+
+
+def export_work_hours(output_path, folder=None):
+    """Write work order number, date, time in and time out to CSV, or to JSON when the path ends in .json"""
+    records = load_records(folder)
+    if output_path.lower().endswith('.json'):
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(records, f, indent=2)
+    else:
+        with open(output_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=EXPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(records)
+    return len(records)
@@ -0,0 +1,221 @@
+"""
+Headless batch runner for the work order pipeline.
+
+Runs the same FileArrangement stages as the GUI buttons, end to end or any
+chosen subset, and prints per-stage timings and results as JSON. Nothing in
+here imports Qt, so it starts quickly and runs on servers and in containers.
+
+Example:
+    python WorkOrderBatch.py "D:/Work Orders" --move-folder "D:/Done" --workers 8 --output run.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import FileArrangement
+import FileTransfer
+import Instrumentation
+import PdfCompression
+import SearchIndex
+import WorkHoursStore
+from DirectorySnapshot import DirectorySnapshot
+from RunJournal import RunJournal
+
+TEMPLATE = "Fillable Work order template.pdf"
+
+
+def run_rename(args, progress):
+    plan = FileArrangement.plan_renames(args.work_folder, args.workers, progress, args.snapshot)
+    renamed = FileArrangement.apply_rename_plan(args.work_folder, plan, progress, args.snapshot)
+    return {"renamed": renamed, "duplicates": sum(1 for entry in plan if entry["duplicate_of"]),
+            "conflicts": sum(1 for entry in plan if entry["conflicts"]), "plan": plan}
+
+
+def run_create_folders(args, progress):
+    return FileArrangement.create_folders_and_move_files(args.work_folder, progress=progress, snapshot=args.snapshot)
+
+
+def run_fill_forms(args, progress):
+    return FileArrangement.fill_pdf_forms(args.work_folder, args.template, progress=progress, workers=args.workers,
+                                          snapshot=args.snapshot, journal=args.journal)
+
+
+def run_backup_images(args, progress):
+    return FileArrangement.create_job_images_folders(args.work_folder, progress=progress, snapshot=args.snapshot)
+
+
+def run_merge(args, progress):
+    return FileArrangement.merge_pdfs_and_images(args.work_folder, progress=progress, workers=args.workers,
+                                                 snapshot=args.snapshot, journal=args.journal,
+                                                 memory_budget=args.memory_budget)
+
+
+def run_restore_images(args, progress):
+    FileArrangement.move_files_and_delete_folder(args.work_folder, progress=progress, snapshot=args.snapshot)
+
+
+def run_move_merged(args, progress):
+    return FileArrangement.move_merged_pdfs(args.work_folder, args.move_folder, progress=progress,
+                                            snapshot=args.snapshot, journal=args.journal,
+                                            workers=args.transfer_workers, buffer_size=args.transfer_buffer_kb * 1024)
+
+
+def run_compress(args, progress):
+    results = FileArrangement.compress_pdf_files(args.move_folder, args.power, workers=args.workers,
+                                                 progress=progress, engine=args.engine,
+                                                 min_size=args.min_size_kb * 1024,
+                                                 target_size=(args.target_size_kb * 1024 if args.target_size_kb
+                                                              else None),
+                                                 snapshot=args.snapshot, journal=args.journal)
+    return {"summary": FileArrangement.summarize_compression(results), "files": results}
+
+
+def run_remove_pre_and_suf(args, progress):
+    FileArrangement.remove_pre_and_suf(args.move_folder, progress=progress, snapshot=args.snapshot)
+
+
+def run_work_hours(args, progress):
+    result = WorkHoursStore.update_folder(args.move_folder, workers=args.workers, progress=progress)
+    if args.export_work_hours:
+        result["exported"] = WorkHoursStore.export_work_hours(args.export_work_hours, args.move_folder)
+    return result
+
+
+def run_index(args, progress):
+    return SearchIndex.update_folder(args.move_folder, workers=args.workers, progress=progress)
+
+
+# (name, function, needs the move folder) in pipeline order
+STAGES = [
+    ("rename", run_rename, False),
+    ("create-folders", run_create_folders, False),
+    ("fill-forms", run_fill_forms, False),
+    ("backup-images", run_backup_images, False),
+    ("merge", run_merge, False),
+    ("restore-images", run_restore_images, False),
+    ("move-merged", run_move_merged, True),
+    ("compress", run_compress, True),
+    ("remove-pre-and-suf", run_remove_pre_and_suf, True),
+    ("work-hours", run_work_hours, True),
+    ("index", run_index, True),
+]
+STAGE_NAMES = [name for name, function, needs_move_folder in STAGES]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the work order pipeline without the GUI.")
+    parser.add_argument("work_folder", help="folder holding the downloaded work order PDFs")
+    parser.add_argument("--move-folder", help="folder the merged and compressed work orders are moved to")
+    parser.add_argument("--stages", default=",".join(STAGE_NAMES),
+                        help=f"comma separated stages to run, in pipeline order "
+                             f"(default: all of {','.join(STAGE_NAMES)})")
+    parser.add_argument("--template", default=TEMPLATE, help="fillable work order template PDF")
+    parser.add_argument("--workers", type=int, default=None, help="parallel workers (default: CPU count)")
+    parser.add_argument("--power", type=int, default=0, choices=range(5),
+                        help="compression level, 0 default to 4 screen (ignored with --target-size-kb)")
+    parser.add_argument("--engine", default=PdfCompression.DEFAULT_ENGINE, choices=PdfCompression.ENGINES,
+                        help="compression engine (default: Ghostscript when installed, else pypdf)")
+    parser.add_argument("--min-size-kb", type=int, default=PdfCompression.MIN_SIZE // 1024,
+                        help="leave PDFs smaller than this uncompressed")
+    parser.add_argument("--target-size-kb", type=int, default=None,
+                        help="pick the mildest level that brings each PDF under this size")
+    parser.add_argument("--transfer-workers", type=int, default=FileTransfer.TRANSFER_WORKERS,
+                        help="merged PDFs copied to the Move Folder at once when it is on another drive")
+    parser.add_argument("--transfer-buffer-kb", type=int, default=FileTransfer.TRANSFER_BUFFER_SIZE // 1024,
+                        help="read and write size of those copies")
+    parser.add_argument("--memory-budget-mb", type=int, default=None,
+                        help="cap the converted photos the merge holds in memory and stream merged PDFs to disk")
+    parser.add_argument("--export-work-hours", metavar="PATH",
+                        help="after the work-hours stage, export the Move Folder's work hours to CSV "
+                             "(or JSON for .json)")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--progress", action="store_true", help="print per-item progress to stderr")
+    parser.add_argument("--fresh", action="store_true",
+                        help="ignore the journal of an interrupted run in this Work Folder instead of resuming it")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="write timing spans as JSON lines to this file (overrides WOM_TRACE)")
+    parser.add_argument("--profile", metavar="STAGE",
+                        help="run cProfile over one stage, e.g. merge, and save STAGE.prof next to the trace")
+    args = parser.parse_args(argv)
+
+    selected = [name.strip() for name in args.stages.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in STAGE_NAMES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+    args.stages = [stage for stage in STAGES if stage[0] in selected]
+    args.memory_budget = args.memory_budget_mb * 2 ** 20 if args.memory_budget_mb is not None else None
+    if any(needs_move_folder for name, function, needs_move_folder in args.stages) and not args.move_folder:
+        parser.error("--move-folder is required for the move-merged, compress, remove-pre-and-suf, work-hours "
+                     "and index stages")
+    if not os.path.isdir(args.work_folder):
+        parser.error(f"work folder does not exist: {args.work_folder}")
+    return args
+
+
+def stderr_progress(stage_name):
+    def progress(done, total, item=None):
+        print(f"[{stage_name}] {done}/{total} {item or ''}", file=sys.stderr, flush=True)
+    return progress
+
+
+def run_pipeline(args):
+    report = {
+        "work_folder": args.work_folder,
+        "move_folder": args.move_folder,
+        "workers": args.workers or os.cpu_count(),
+        "stages": [],
+        "ok": True,
+    }
+    # One listing of the folders for the whole run, kept up to date by the stages
+    args.snapshot = getattr(args, "snapshot", None) or DirectorySnapshot()
+    # An interrupted run in this Work Folder left a journal: finish its open operations and skip what it did
+    args.journal = RunJournal.for_folder(args.work_folder)
+    if getattr(args, "fresh", False):
+        args.journal.finish()
+    report["journal"] = {"path": args.journal.path, "resumed": args.journal.has_progress(),
+                         "recovered": args.journal.recover()}
+    run_start = time.perf_counter()
+    for name, function, needs_move_folder in args.stages:
+        stage = {"name": name, "seconds": None, "result": None, "error": None}
+        report["stages"].append(stage)
+        progress = stderr_progress(name) if args.progress else None
+        start = time.perf_counter()
+        try:
+            stage["result"] = function(args, progress)
+        except Exception as e:
+            stage["error"] = f"{type(e).__name__}: {e}"
+            report["ok"] = False
+        stage["seconds"] = round(time.perf_counter() - start, 3)
+        if stage["error"]:
+            break  # Later stages depend on this one's output
+    report["total_seconds"] = round(time.perf_counter() - run_start, 3)
+    if report["ok"]:
+        args.journal.finish()
+    args.journal.close()
+    report["directory_scans"] = args.snapshot.scans
+    report["counters"] = Instrumentation.counters()  # This process only, the workers' counts are in the trace
+    return report
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.trace or args.profile:
+        Instrumentation.configure(args.trace or Instrumentation.trace_path(),
+                                  args.profile or Instrumentation.profile_stage())
+    report = run_pipeline(args)
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
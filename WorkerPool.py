@@ -0,0 +1,46 @@
+"""
+The process and thread pools the pipeline stages run their files in.
+
+run_pool() submits one call per item and hands the results back in the
+calling thread as they complete, so a stage can report progress and update
+its snapshot and journal between two results. When the stage stops early,
+because the progress callback raised JobCancelled or a result raised, the
+calls still queued are dropped and only the ones already running are
+waited for.
+"""
+
+import contextlib
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def pool_size(workers, items):
+    """Workers to start for items calls: the requested number or one per CPU, never more than there are items"""
+    return max(1, min(workers or os.cpu_count() or 1, items))
+
+
+@contextlib.contextmanager
+def run_pool(function, arguments, workers=None, executor_class=ProcessPoolExecutor, discard=None):
+    """
+    Call function(*args) for every args tuple of arguments and give an iterator of (args, result) in completion order.
+    discard(args, result) is called for calls that finished after the stage stopped, e.g. to delete their output.
+    """
+    arguments = list(arguments)
+    handed_out = set()
+    with executor_class(max_workers=pool_size(workers, len(arguments))) as executor:
+        futures = {executor.submit(function, *args): args for args in arguments}
+
+        def results():
+            for future in as_completed(futures):
+                handed_out.add(future)
+                yield futures[future], future.result()
+
+        try:
+            yield results()
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            if discard:
+                for future, args in futures.items():
+                    if future not in handed_out and not future.cancelled() and future.exception() is None:
+                        discard(args, future.result())
+            raise
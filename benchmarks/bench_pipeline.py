@@ -0,0 +1,194 @@
+"""
+Times every stage of the work order pipeline on a synthetic corpus.
+
+For each scale a fresh corpus is generated (see corpus.py), photos are
+dropped into the order folders right after folder creation, and the stages
+of WorkOrderBatch run in order. Each stage records wall time, orders per
+second and peak memory: the peak RSS of this process plus its worker
+processes, sampled while the stage runs, and optionally the tracemalloc
+peak of this process. The text cache and work hours store point at the run
+folder, so every run starts cold and never touches the user's own data.
+
+    python benchmarks/bench_pipeline.py --orders 10,100,1000 --photos 3 --output bench.json
+    python benchmarks/bench_pipeline.py --orders 100 --compare bench.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import corpus
+import FileTransfer
+import Instrumentation
+import PdfCompression
+import WorkOrderBatch
+from DirectorySnapshot import DirectorySnapshot
+
+
+def max_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {"self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20, 1),
+            "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2 ** 20, 1)}
+
+
+def isolate_user_dirs(run_folder):
+    for variable in ('XDG_CACHE_HOME', 'XDG_DATA_HOME', 'LOCALAPPDATA'):
+        os.environ[variable] = os.path.join(run_folder, 'user')
+
+
+def run_scale(orders, args, run_folder):
+    work_folder = os.path.join(run_folder, 'work')
+    move_folder = os.path.join(run_folder, 'move')
+    os.makedirs(move_folder)
+    isolate_user_dirs(run_folder)
+
+    start = time.perf_counter()
+    corpus.generate_orders(work_folder, orders, args.seed)
+    template = os.path.join(run_folder, WorkOrderBatch.TEMPLATE)
+    corpus.write_template(template)
+    result = {"orders": orders, "photos_per_order": args.photos, "photos": 0,
+              "generate_seconds": round(time.perf_counter() - start, 3), "stages": [], "ok": True}
+
+    batch_args = argparse.Namespace(work_folder=work_folder, move_folder=move_folder, template=template,
+                                    workers=args.workers, power=args.power, engine=args.engine,
+                                    min_size_kb=PdfCompression.MIN_SIZE // 1024, target_size_kb=None,
+                                    export_work_hours=None, snapshot=DirectorySnapshot(), journal=None,
+                                    memory_budget=args.memory_budget_mb * 2 ** 20 if args.memory_budget_mb else None,
+                                    transfer_workers=FileTransfer.TRANSFER_WORKERS,
+                                    transfer_buffer_kb=FileTransfer.TRANSFER_BUFFER_SIZE // 1024)
+    for name, function, needs_move_folder in WorkOrderBatch.STAGES:
+        if name not in args.stages:
+            continue
+        stage = {"name": name, "seconds": None, "orders_per_second": None, "peak_rss_mb": None, "error": None}
+        if args.tracemalloc:
+            tracemalloc.start()
+        # This process plus the worker processes of the stage's pools
+        with Instrumentation.PeakRss(include_children=True) as sampler:
+            start = time.perf_counter()
+            try:
+                function(batch_args, None)
+            except Exception as e:
+                stage["error"] = f"{type(e).__name__}: {e}"
+            seconds = time.perf_counter() - start
+        if args.tracemalloc:
+            stage["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            tracemalloc.stop()
+        stage["seconds"] = round(seconds, 3)
+        stage["orders_per_second"] = round(orders / seconds, 2) if seconds else None
+        if sampler.peak is not None:
+            stage["peak_rss_mb"] = round(sampler.peak / 2 ** 20, 1)
+        result["stages"].append(stage)
+        if stage["error"]:
+            result["ok"] = False
+            break
+
+        if name == 'create-folders' and args.photos:
+            # The photos arrive in the order folders after they were created, as they do from the field
+            start = time.perf_counter()
+            result["photos"] = corpus.add_photos(work_folder, args.photos, (args.photo_width, args.photo_height),
+                                                 args.seed)
+            result["generate_seconds"] = round(result["generate_seconds"] + time.perf_counter() - start, 3)
+            batch_args.snapshot.refresh(work_folder)
+    result["directory_scans"] = batch_args.snapshot.scans
+    result["max_rss_mb"] = max_rss_mb()
+    return result
+
+
+def compare(report, previous):
+    # Seconds of this run against the previous one for every scale and stage both of them have
+    old = {(scale["orders"], stage["name"]): stage.get("seconds")
+           for scale in previous.get("scales", []) for stage in scale["stages"]}
+    lines = []
+    for scale in report["scales"]:
+        for stage in scale["stages"]:
+            before = old.get((scale["orders"], stage["name"]))
+            if before and stage.get("seconds"):
+                change = (stage["seconds"] - before) / before * 100
+                lines.append(f"{scale['orders']:>6} {stage['name']:<20} {before:>9.3f}s -> {stage['seconds']:>9.3f}s "
+                             f"({change:+.1f}%)")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--orders", default="10,100", help="comma separated corpus sizes, 10 to 10000 orders")
+    parser.add_argument("--photos", type=int, default=3, help="photos per order")
+    parser.add_argument("--photo-width", type=int, default=2016)
+    parser.add_argument("--photo-height", type=int, default=1512)
+    parser.add_argument("--stages", default=",".join(WorkOrderBatch.STAGE_NAMES),
+                        help="comma separated stages to time (default: all)")
+    parser.add_argument("--workers", type=int, default=None, help="parallel workers (default: CPU count)")
+    parser.add_argument("--power", type=int, default=0, choices=range(5), help="compression level")
+    parser.add_argument("--engine", default=PdfCompression.DEFAULT_ENGINE, choices=PdfCompression.ENGINES,
+                        help="compression engine")
+    parser.add_argument("--memory-budget-mb", type=int, default=None, help="merge with this memory budget")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="also record the Python allocation peak of this process (slows the stages down)")
+    parser.add_argument("--folder", help="keep the corpora here instead of a temporary folder")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", metavar="PATH", help="previous JSON report to compare stage times against")
+    args = parser.parse_args(argv)
+
+    scales = [int(value) for value in args.orders.split(",") if value.strip()]
+    args.stages = [name.strip() for name in args.stages.split(",") if name.strip()]
+    unknown = [name for name in args.stages if name not in WorkOrderBatch.STAGE_NAMES]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "workers": args.workers or os.cpu_count(),
+        "engine": PdfCompression.get_engine(args.engine).name,
+        "photo_size": [args.photo_width, args.photo_height],
+        "scales": [],
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+
+    base = args.folder or tempfile.mkdtemp(prefix="wom-bench-")
+    try:
+        for orders in scales:
+            run_folder = os.path.join(base, f"orders-{orders}")
+            shutil.rmtree(run_folder, ignore_errors=True)
+            os.makedirs(run_folder)
+            print(f"{orders} orders ...", file=sys.stderr, flush=True)
+            report["scales"].append(run_scale(orders, args, run_folder))
+    finally:
+        if not args.folder:
+            shutil.rmtree(base, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if previous:
+        for line in compare(report, previous):
+            print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
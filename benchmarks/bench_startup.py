@@ -0,0 +1,88 @@
+"""
+Times the startup of the window: imports, window construction and first paint.
+
+Each run starts the program with WOM_STARTUP_REPORT set, which makes it
+append its own startup times (seconds since its first line ran) to a file
+and close as soon as the window is painted. The wall time of the whole
+process, including the interpreter or the PyInstaller bootloader, is
+measured here. The medians of all runs are reported, and --compare prints
+them against an earlier report to catch regressions.
+
+    python benchmarks/bench_startup.py --runs 10 --output startup.json
+    python benchmarks/bench_startup.py --exe "dist/Work Order Program.exe" --compare startup.json
+
+On a machine without a display, set QT_QPA_PLATFORM=offscreen.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = ["imports", "window", "first_paint"]
+
+
+def run_once(command, report_path, env):
+    start = time.perf_counter()
+    subprocess.run(command, cwd=ROOT, env=env, check=True, timeout=120)
+    wall = time.perf_counter() - start
+    with open(report_path, encoding="utf-8") as f:
+        report = json.loads(f.readlines()[-1])
+    report["seconds"]["process"] = round(wall, 4)
+    return report
+
+
+def compare(report, previous):
+    lines = []
+    for phase, seconds in report["median"].items():
+        before = previous.get("median", {}).get(phase)
+        if before:
+            lines.append(f"{phase:<12} {before:>7.3f}s -> {seconds:>7.3f}s ({(seconds - before) / before * 100:+.1f}%)")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--exe", help="time this PyInstaller build instead of the script")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", metavar="PATH", help="previous JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+
+    command = [args.exe] if args.exe else [sys.executable, os.path.join(ROOT, "Work Order Program.py")]
+    runs = []
+    with tempfile.TemporaryDirectory(prefix="wom-startup-") as folder:
+        env = dict(os.environ, WOM_STARTUP_REPORT=os.path.join(folder, "startup.jsonl"))
+        for _ in range(args.runs):
+            runs.append(run_once(command, env["WOM_STARTUP_REPORT"], env))
+
+    phases = PHASES + ["process"]
+    report = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "command": command,
+              "frozen": runs[0]["frozen"] if runs else None,
+              "median": {phase: round(statistics.median(run["seconds"][phase] for run in runs), 4)
+                         for phase in phases if runs and all(phase in run["seconds"] for run in runs)},
+              "runs": [run["seconds"] for run in runs]}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if previous:
+        for line in compare(report, previous):
+            print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
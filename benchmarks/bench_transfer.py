@@ -0,0 +1,73 @@
+"""
+Times the move of merged PDFs to a Move Folder on a slow share, locally.
+
+The share is stood in for by FileTransfer.ThrottledOpener: every open and
+every read or write request costs a round trip, and all requests share one
+link of the given bandwidth. Each configuration moves the same files
+between two temporary folders as cross-device copies, from one worker with
+a 64KB buffer (what shutil.move did) to the engine's defaults.
+
+    python benchmarks/bench_transfer.py --files 40 --size-mb 3 --bandwidth-mb 20 --latency-ms 20
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import FileTransfer
+
+
+def make_files(folder, files, size):
+    os.makedirs(folder)
+    block = os.urandom(min(size, 1024 * 1024))
+    for index in range(files):
+        with open(os.path.join(folder, f"{100000 + index}_merged.pdf"), "wb") as f:
+            written = 0
+            while written < size:
+                written += f.write(block[:size - written])
+
+
+def run(args, workers, buffer_size):
+    run_folder = tempfile.mkdtemp(prefix="bench-transfer-")
+    try:
+        source, destination = os.path.join(run_folder, "work"), os.path.join(run_folder, "move")
+        make_files(source, args.files, int(args.size_mb * 2 ** 20))
+        os.makedirs(destination)
+        moves = [(os.path.join(source, name), os.path.join(destination, name)) for name in sorted(os.listdir(source))]
+        opener = FileTransfer.ThrottledOpener(args.bandwidth_mb * 2 ** 20, args.latency_ms / 1000)
+        report = FileTransfer.transfer_files(moves, workers, buffer_size, opener, same_device=False)
+        report.pop("results")
+        return report
+    finally:
+        shutil.rmtree(run_folder)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--size-mb", type=float, default=3)
+    parser.add_argument("--bandwidth-mb", type=float, default=20, help="bandwidth of the simulated share, MB/s")
+    parser.add_argument("--latency-ms", type=float, default=20, help="round trip of every open, read and write")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    configurations = [(1, 64 * 1024), (1, FileTransfer.TRANSFER_BUFFER_SIZE),
+                      (FileTransfer.TRANSFER_WORKERS, FileTransfer.TRANSFER_BUFFER_SIZE)]
+    report = {"files": args.files, "size_mb": args.size_mb, "bandwidth_mb": args.bandwidth_mb,
+              "latency_ms": args.latency_ms, "runs": [run(args, workers, buffer_size)
+                                                      for workers, buffer_size in configurations]}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
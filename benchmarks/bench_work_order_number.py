@@ -0,0 +1,87 @@
+"""
+Compares the content-stream fast path for finding the work order number
+against full pypdf text extraction on a folder of work order PDFs.
+
+Neither path goes through PdfTextCache, so every run measures real parsing.
+
+    python benchmarks/bench_work_order_number.py "D:/Work Orders" --output wo_number.json
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pypdf
+
+from FileInfoFill import find_work_order_number_fast
+
+
+def find_work_order_number_full(filename):
+    # The rename step before the fast path existed: extract_text() page by page until the number shows up
+    with open(filename, 'rb') as file:
+        for page in pypdf.PdfReader(file).pages:
+            match = re.search(r'Work Order #\s*(\d+)', page.extract_text())
+            if match:
+                return match.group(1)
+    return None
+
+
+def time_call(function, filename, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(filename)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def run(corpus, repeat=3):
+    files = sorted(os.path.join(corpus, name) for name in os.listdir(corpus) if name.lower().endswith('.pdf'))
+    report = {"corpus": corpus, "files": len(files), "repeat": repeat, "fast_hits": 0, "mismatches": [],
+              "fast_seconds": 0.0, "full_seconds": 0.0, "per_file": []}
+    for filename in files:
+        fast_number, fast_seconds = time_call(find_work_order_number_fast, filename, repeat)
+        full_number, full_seconds = time_call(find_work_order_number_full, filename, repeat)
+        report["fast_seconds"] += fast_seconds
+        report["full_seconds"] += full_seconds
+        if fast_number:
+            report["fast_hits"] += 1
+            if fast_number != full_number:
+                report["mismatches"].append({"file": filename, "fast": fast_number, "full": full_number})
+        report["per_file"].append({"file": os.path.basename(filename), "fast_seconds": round(fast_seconds, 5),
+                                   "full_seconds": round(full_seconds, 5), "number": full_number,
+                                   "fast_hit": bool(fast_number)})
+    if report["fast_seconds"]:
+        report["speedup"] = round(report["full_seconds"] / report["fast_seconds"], 2)
+    report["fast_seconds"] = round(report["fast_seconds"], 4)
+    report["full_seconds"] = round(report["full_seconds"], 4)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("corpus", help="folder of work order PDFs")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per file, the fastest one counts")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run(args.corpus, args.repeat)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    print(f"{report['files']} files, fast path hit {report['fast_hits']}, "
+          f"{len(report['mismatches'])} mismatches, speedup x{report.get('speedup', 0)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
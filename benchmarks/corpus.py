@@ -0,0 +1,161 @@
+"""
+Synthetic work order corpus for the benchmarks.
+
+Work order PDFs are written by hand with the same text the regexes in
+FileInfoFill and FileArrangement look for: 'Work Order #', 'Request By',
+the doubled 'Location' heading, 'Description', 'Closing Comments', and a
+date plus time in and time out on the second line. The fillable template
+has the three AcroForm fields that write_to_pdf fills. Job photos are
+JPEGs with an EXIF orientation, so the conversion has to rotate them.
+
+    python benchmarks/corpus.py /tmp/corpus --orders 100 --photos 3
+"""
+
+import argparse
+import os
+import random
+import sys
+
+from PIL import Image
+
+STREETS = ["Main St", "Oak Ave", "Maple Dr", "Cedar Ln", "Pine Rd", "Elm St", "Lakeview Blvd", "Hill Ct"]
+CITIES = ["Springfield", "Riverside", "Fairview", "Greenville", "Madison"]
+TASKS = ["Replace broken window latch", "Repair leaking kitchen faucet", "Patch drywall in hallway",
+         "Service HVAC unit and replace filter", "Replace smoke detector batteries", "Fix sticking front door"]
+EXIF_ORIENTATIONS = [1, 3, 6, 8]
+
+
+def pdf_string(text):
+    return '(' + text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+def write_pdf(path, objects):
+    # objects[0] must be the catalog; every object body is referenced as "<index + 1> 0 R"
+    output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f'{number} 0 obj\n'.encode() + body + b'\nendobj\n'
+    xref = len(output)
+    output += f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode()
+    for offset in offsets:
+        output += f'{offset:010d} 00000 n \n'.encode()
+    output += f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode()
+    with open(path, 'wb') as f:
+        f.write(output)
+
+
+def text_stream(lines, top=760, leading=18):
+    commands = ['BT', '/F1 11 Tf', f'50 {top} Td', f'{leading} TL']
+    for line in lines:
+        commands.append(f'{pdf_string(line)} Tj T*')
+    commands.append('ET')
+    content = '\n'.join(commands).encode('latin-1')
+    return b'<< /Length %d >>\nstream\n' % len(content) + content + b'\nendstream'
+
+
+def work_order_lines(work_order_number, rng):
+    date = f"{rng.randint(1, 12)}/{rng.randint(1, 28)}/{rng.randint(20, 24)}"
+    time_in = f"{rng.randint(7, 11):02d}:{rng.choice(['00', '15', '30', '45'])}"
+    time_out = f"{rng.randint(12, 17):02d}:{rng.choice(['00', '15', '30', '45'])}"
+    address = f"{rng.randint(10, 9999)} {rng.choice(STREETS)}, {rng.choice(CITIES)}"
+    return [
+        "Work Order Summary",
+        f"{date} {time_in} {time_out}",
+        f"Work Order # {work_order_number}",
+        f"Request By {rng.choice(['Front Office', 'Tenant Portal', 'Property Manager'])}",
+        "Location",
+        f"Location {address}",
+        f"Description {rng.choice(TASKS)}",
+        "Closing Comments Completed, area cleaned up",
+    ]
+
+
+def write_work_order(path, work_order_number, rng, pages=2):
+    font = b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'
+    page_numbers = [4 + 2 * i for i in range(pages)]
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [%s] /Count %d >>' % (' '.join(f'{n} 0 R' for n in page_numbers).encode(), pages),
+        font,
+    ]
+    for page in range(pages):
+        lines = work_order_lines(work_order_number, rng) if page == 0 else [
+            "Work Order Notes", f"Page {page + 1}"] + [rng.choice(TASKS) for _ in range(20)]
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % (len(objects) + 2))
+        objects.append(text_stream(lines))
+    write_pdf(path, objects)
+
+
+def write_template(path):
+    fields = ["Work Order #", "Address", "Description"]
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R /AcroForm << /Fields [5 0 R 6 0 R 7 0 R] /NeedAppearances true >> >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 8 0 R >> >> '
+        b'/Contents 4 0 R /Annots [5 0 R 6 0 R 7 0 R] >>',
+        text_stream(["Fillable Work Order"] + [f"{field}:" for field in fields]),
+    ]
+    for index, field in enumerate(fields):
+        top = 740 - 18 * index
+        objects.append(f'<< /Type /Annot /Subtype /Widget /FT /Tx /T {pdf_string(field)} /P 3 0 R '
+                       f'/Rect [150 {top - 14} 550 {top}] /DA (/Helv 10 Tf 0 g) >>'.encode('latin-1'))
+    objects.append(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+    write_pdf(path, objects)
+
+
+def write_photo(path, size, orientation, rng):
+    # Noise on top of a gradient gives phone-photo-like JPEG sizes instead of a flat, tiny file
+    base = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, rng.randint(20, 60))
+    image = Image.merge('RGB', (base, noise, Image.blend(base, noise, 0.5)))
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    image.save(path, 'JPEG', quality=85, exif=exif)
+
+
+def generate_orders(work_folder, orders, seed=0, first_number=100000):
+    """Downloaded work orders as they arrive, with browser-style names the rename step has to fix"""
+    rng = random.Random(seed)
+    os.makedirs(work_folder, exist_ok=True)
+    numbers = []
+    for index in range(orders):
+        work_order_number = str(first_number + index)
+        write_work_order(os.path.join(work_folder, f"WorkOrder_download_{index:05d}.pdf"), work_order_number, rng)
+        numbers.append(work_order_number)
+    return numbers
+
+
+def add_photos(work_folder, photos_per_order, size=(2016, 1512), seed=0):
+    """Job photos dropped into each order folder after the folders were created"""
+    rng = random.Random(seed)
+    count = 0
+    for entry in sorted(os.scandir(work_folder), key=lambda entry: entry.name):
+        if not entry.is_dir():
+            continue
+        for index in range(photos_per_order):
+            write_photo(os.path.join(entry.path, f"IMG_{index:04d}.jpg"), size, rng.choice(EXIF_ORIENTATIONS), rng)
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic work order corpus.")
+    parser.add_argument("folder")
+    parser.add_argument("--orders", type=int, default=100)
+    parser.add_argument("--photos", type=int, default=0, help="photos per order folder (folders are created)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    generate_orders(args.folder, args.orders, args.seed)
+    write_template(os.path.join(args.folder, "Fillable Work order template.pdf"))
+    if args.photos:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import FileArrangement
+        FileArrangement.create_folders_and_move_files(args.folder)
+        add_photos(args.folder, args.photos, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
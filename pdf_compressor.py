@@ -21,30 +21,28 @@ On MacOSX install via command line `brew install ghostscript`.
 import os.path
 import shutil
 import subprocess
-import sys
 import FileArrangement
+import Instrumentation
 
 
-def compress(input_file_path, output_file_path, power=0):
+def compress(input_file_path, output_file_path, power=0, gs=None):
     """Function to compress PDF via Ghostscript command line interface"""
     quality = {0: "/default", 1: "/prepress", 2: "/printer", 3: "/ebook", 4: "/screen"}
 
     # Basic controls
     # Check if valid path
     if not os.path.isfile(input_file_path):
-        FileArrangement.debug_print("Error: invalid path for input PDF file.", input_file_path)
-        sys.exit(1)
+        raise FileNotFoundError(f"Invalid path for input PDF file: {input_file_path}")
 
     # Check if file is a PDF by extension
     if input_file_path.split('.')[-1].lower() != 'pdf':
-        FileArrangement.debug_print(f"Error: input file is not a PDF.", input_file_path)
-        sys.exit(1)
+        raise ValueError(f"Input file is not a PDF: {input_file_path}")
 
-    gs = get_ghostscript_path()
-    FileArrangement.debug_print("Compress PDF...")
+    gs = gs or get_ghostscript_path()
+    FileArrangement.debug_print("Compress PDF...", input_file_path)
     initial_size = os.path.getsize(input_file_path)
-    subprocess.call(
-        [
+    with Instrumentation.span("gs", file=os.path.basename(input_file_path), power=power):
+        return_code = subprocess.call([
             gs,
             "-sDEVICE=pdfwrite",
             "-dCompatibilityLevel=1.4",
@@ -54,13 +52,17 @@ def compress(input_file_path, output_file_path, power=0):
             "-dBATCH",
             "-sOutputFile={}".format(output_file_path),
             input_file_path,
-        ]
-    )
+        ])
+    if return_code != 0 or not os.path.isfile(output_file_path):
+        raise RuntimeError(f"Ghostscript exited with code {return_code} for {input_file_path}")
     final_size = os.path.getsize(output_file_path)
-    ratio = 1 - (final_size / initial_size)
+    Instrumentation.count("bytes_read", initial_size)
+    Instrumentation.count("bytes_written", final_size)
+    ratio = 1 - (final_size / initial_size) if initial_size else 0.0
     FileArrangement.debug_print("Compression by {0:.0%}.".format(ratio))
     FileArrangement.debug_print("Final file size is {0:.5f}MB".format(final_size / 1000000))
     FileArrangement.debug_print("Done.")
+    return {"initial_size": initial_size, "final_size": final_size, "ratio": ratio}
 
 
 def get_ghostscript_path():
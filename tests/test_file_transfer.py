@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from FileTransfer import PART_SUFFIX, copy_verified
+
+
+class ShortWrites:
+    """Opens files like open(), except that writes lose their last byte, like a copy to a share that dropped"""
+
+    def __call__(self, path, mode="r"):
+        file = open(path, mode)
+        if "w" in mode:
+            write = file.write
+            file.write = lambda data: write(data[:-1])
+        return file
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def test_copy_keeps_the_contents_and_modification_time(tmp_path):
+    data = os.urandom(300_000)
+    source = write(tmp_path / "100.pdf", data)
+    os.utime(source, ns=(1_600_000_000_000_000_000, 1_600_000_000_000_000_000))
+    destination = str(tmp_path / "moved.pdf")
+
+    assert copy_verified(source, destination, buffer_size=64 * 1024) == len(data)
+    with open(destination, "rb") as f:
+        assert f.read() == data
+    assert os.stat(destination).st_mtime_ns == os.stat(source).st_mtime_ns
+    assert not os.path.exists(destination + PART_SUFFIX)
+
+
+def test_copy_replaces_an_existing_destination(tmp_path):
+    source = write(tmp_path / "100.pdf", b"new")
+    destination = write(tmp_path / "moved.pdf", b"old contents")
+    copy_verified(source, destination)
+    with open(destination, "rb") as f:
+        assert f.read() == b"new"
+
+
+def test_a_short_copy_raises_and_leaves_the_destination_alone(tmp_path):
+    source = write(tmp_path / "100.pdf", b"x" * 1000)
+    destination = write(tmp_path / "moved.pdf", b"old contents")
+    with pytest.raises(OSError):
+        copy_verified(source, destination, buffer_size=100, opener=ShortWrites())
+    with open(destination, "rb") as f:
+        assert f.read() == b"old contents"
+    assert sorted(os.listdir(tmp_path)) == ["100.pdf", "moved.pdf"]
@@ -0,0 +1,73 @@
+import os
+
+from FileTransfer import PART_SUFFIX
+from RunJournal import RunJournal, roll_forward
+
+
+def write(path, data=b"x" * 100):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def move_intent(source, destination, destination_existed=False):
+    return {"action": "move", "paths": [source, destination], "destination_existed": destination_existed}
+
+
+def test_delete_removes_the_files_still_left(tmp_path):
+    left = write(tmp_path / "1.jpg")
+    gone = str(tmp_path / "2.jpg")
+    roll_forward({"action": "delete", "paths": [gone, left]})
+    assert os.listdir(tmp_path) == []
+
+
+def test_move_drops_a_copy_cut_short_before_it_was_verified(tmp_path):
+    source = write(tmp_path / "100.pdf")
+    destination = str(tmp_path / "moved.pdf")
+    write(destination + PART_SUFFIX, b"x" * 10)
+    roll_forward(move_intent(source, destination))
+    assert os.listdir(tmp_path) == ["100.pdf"]
+
+
+def test_move_deletes_the_source_once_the_copy_arrived(tmp_path):
+    source = write(tmp_path / "100.pdf")
+    destination = write(tmp_path / "moved.pdf")
+    roll_forward(move_intent(source, destination))
+    assert os.listdir(tmp_path) == ["moved.pdf"]
+
+
+def test_move_deletes_a_partial_destination_and_keeps_the_source(tmp_path):
+    source = write(tmp_path / "100.pdf")
+    destination = write(tmp_path / "moved.pdf", b"x" * 10)
+    roll_forward(move_intent(source, destination))
+    assert os.listdir(tmp_path) == ["100.pdf"]
+
+
+def test_move_keeps_a_destination_the_run_did_not_create(tmp_path):
+    source = write(tmp_path / "100.pdf")
+    destination = write(tmp_path / "moved.pdf", b"y" * 100)
+    roll_forward(move_intent(source, destination, destination_existed=True))
+    assert sorted(os.listdir(tmp_path)) == ["100.pdf", "moved.pdf"]
+    with open(destination, "rb") as f:
+        assert f.read() == b"y" * 100
+
+
+def test_recover_finishes_the_operations_a_crashed_run_left_open(tmp_path):
+    folder = tmp_path / "order"
+    folder.mkdir()
+    photos = [write(folder / "1.jpg"), write(folder / "2.jpg")]
+    path = str(tmp_path / "journal.jsonl")
+
+    journal = RunJournal(path)
+    journal.mark_done("merge", "order")
+    journal.intend("merge", "delete", photos)
+    os.remove(photos[0])
+    journal.close()  # The crash: the intent is never committed
+
+    journal = RunJournal(path)
+    assert journal.is_done("merge", "order")
+    recovered = journal.recover()
+    journal.close()
+    assert [record["paths"] for record in recovered] == [photos]
+    assert os.listdir(folder) == []
+    assert RunJournal(path).pending == {}
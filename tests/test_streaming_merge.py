@@ -0,0 +1,87 @@
+import os
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import (ArrayObject, BooleanObject, DictionaryObject, FloatObject, NameObject,
+                           TextStringObject)
+
+from StreamingMerge import StreamingMerge
+
+
+def write_form(path, field_name, value, font_name, need_appearances=False):
+    """A one-page PDF with a single text field, laid out like the order download or the filled template"""
+    writer = PdfWriter()
+    page = writer.add_blank_page(612, 792)
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"), NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica")}))
+    field = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Annot"), NameObject("/Subtype"): NameObject("/Widget"),
+        NameObject("/FT"): NameObject("/Tx"), NameObject("/T"): TextStringObject(field_name),
+        NameObject("/V"): TextStringObject(value),
+        NameObject("/Rect"): ArrayObject([FloatObject(50), FloatObject(700), FloatObject(300), FloatObject(720)])}))
+    page[NameObject("/Annots")] = ArrayObject([field])
+    acroform = DictionaryObject({
+        NameObject("/Fields"): ArrayObject([field]),
+        NameObject("/DA"): TextStringObject(f"/{font_name} 12 Tf 0 g"),
+        NameObject("/DR"): DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject(f"/{font_name}"): font})})})
+    if need_appearances:
+        acroform[NameObject("/NeedAppearances")] = BooleanObject(True)
+    writer._root_object[NameObject("/AcroForm")] = writer._add_object(acroform)
+    writer.write(path)
+    return path
+
+
+def write_photo_page(path):
+    writer = PdfWriter()
+    writer.add_blank_page(400, 300)
+    writer.write(path)
+    return path
+
+
+def test_merged_file_reads_back_with_every_page_and_field(tmp_path):
+    order = write_form(tmp_path / "100.pdf", "Order", "Work Order # 100", "Helv")
+    template = write_form(tmp_path / "template.pdf", "Location", "12 Cedar St", "TiRo", need_appearances=True)
+    photo = write_photo_page(tmp_path / "photo.pdf")
+    output = str(tmp_path / "100_merged.pdf")
+
+    with StreamingMerge(output) as merger:
+        merger.append(str(order))
+        merger.append(str(template))
+        with open(photo, "rb") as f:
+            merger.append(f)
+
+    reader = PdfReader(output, strict=True)
+    assert len(reader.pages) == 3
+    assert [page.mediabox.width for page in reader.pages] == [612, 612, 400]
+    fields = reader.get_fields()
+    assert fields["Order"]["/V"] == "Work Order # 100"
+    assert fields["Location"]["/V"] == "12 Cedar St"
+    assert not os.path.exists(output + ".tmp")
+
+
+def test_form_settings_of_the_template_survive_an_order_with_its_own_form(tmp_path):
+    # The order is appended first; its /AcroForm used to be the only one whose settings were kept
+    order = write_form(tmp_path / "100.pdf", "Order", "Work Order # 100", "Helv")
+    template = write_form(tmp_path / "template.pdf", "Location", "12 Cedar St", "TiRo", need_appearances=True)
+    output = str(tmp_path / "100_merged.pdf")
+
+    with StreamingMerge(output) as merger:
+        merger.append(str(order))
+        merger.append(str(template))
+
+    acroform = PdfReader(output).trailer["/Root"]["/AcroForm"]
+    assert acroform["/NeedAppearances"] == BooleanObject(True)
+    assert acroform["/DA"] == "/TiRo 12 Tf 0 g"
+    assert set(acroform["/DR"]["/Font"]) == {"/Helv", "/TiRo"}
+    assert len(acroform["/Fields"]) == 2
+
+
+def test_a_failed_merge_leaves_no_file_behind(tmp_path):
+    output = str(tmp_path / "100_merged.pdf")
+    with pytest.raises(Exception):
+        with StreamingMerge(output) as merger:
+            merger.append(str(write_photo_page(tmp_path / "photo.pdf")))
+            merger.append(str(tmp_path / "missing.pdf"))
+    assert os.listdir(tmp_path) == ["photo.pdf"]